@@ -0,0 +1,343 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# The backups of the Custom levelset made by the editor, and a tool to
+# list and restore them.
+#
+# Each version is stored once, in a file named after the MD5 of its
+# text, so backing up an unchanged set adds nothing.  The newest version
+# is stored whole and every older one as its differences from the next
+# newer one, all compressed with zlib.  The index lists the versions
+# with the time of each backup, and is only replaced once the files it
+# refers to are all written.  As backups age they are thinned out:
+# the newest keep_last are kept, then the last of each of keep_days
+# days, then the last of each of keep_weeks weeks.
+
+# Import Modules
+import os, sys, time, md5, zlib, difflib
+
+backup_dir = os.path.join('user_circuits', 'backups')
+custom_file = os.path.join('user_circuits', 'Custom')
+
+# Retention policy
+keep_last = 10     # Newest backups kept
+keep_days = 7      # Days of which the last backup is kept
+keep_weeks = 4     # Weeks of which the last backup is kept
+
+# The names of the copies made before there was a store
+old_backup_suffix = '_Custom'
+old_backup_format = '%Y%m%d-%H:%M'
+
+# Make the renames done in a directory last through a crash
+def sync_dir(directory):
+	if sys.platform[0:3] == 'win': return
+	fd = os.open( directory, os.O_RDONLY)
+	try:
+		os.fsync( fd)
+	finally:
+		os.close( fd)
+
+# Write a file through a temporary file, so that it is never left
+# half written
+def write_file(filename, data):
+	tmpname = filename + '.' + `os.getpid()` + '~'
+	f = open( tmpname, 'wb')
+	f.write( data)
+	f.flush()
+	os.fsync( f.fileno())
+	f.close()
+	if sys.platform[0:3] == 'win' and os.path.exists( filename):
+		os.remove( filename)
+	os.rename( tmpname, filename)
+	sync_dir( os.path.dirname( filename) or '.')
+
+# The differences that turn base into text, as a list of lines: "=i j"
+# copies lines i to j of base, "+n" is followed by n lines of text
+def make_delta(base, text):
+	base_lines = base.splitlines( 1)
+	lines = text.splitlines( 1)
+	delta = []
+	matcher = difflib.SequenceMatcher( None, base_lines, lines, False)
+	for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+		if tag == 'equal':
+			delta.append( "=%d %d\n" % (i1, i2))
+		elif j2 > j1:
+			delta.append( "+%d\n" % (j2 - j1))
+			delta.extend( lines[j1:j2])
+	return ''.join(delta)
+
+def apply_delta(base, delta):
+	base_lines = base.splitlines( 1)
+	lines = delta.splitlines( 1)
+	text = []
+	i = 0
+	while i < len(lines):
+		op = lines[i]
+		i += 1
+		if op[0] == '=':
+			start, end = map( int, op[1:].split())
+			text.extend( base_lines[start:end])
+		else:
+			count = int(op[1:])
+			text.extend( lines[i:i+count])
+			i += count
+	return ''.join(text)
+
+# The index lists one version per line: the time of the backup, its
+# key and the key of the version it is a delta from, or "-".  The object
+# holding a version is named after both keys, so that storing it
+# against another base makes a new file and never changes one the
+# index refers to.
+class BackupStore:
+	def __init__(self, directory=backup_dir):
+		self.directory = directory
+		self.index_file = os.path.join( directory, 'index')
+
+	# The versions backed up, oldest first, as (time, key, base)
+	def _index(self):
+		if not os.path.exists( self.index_file): return []
+		index = []
+		f = open( self.index_file)
+		for line in f:
+			words = line.split()
+			if len(words) == 3:
+				base = words[2]
+				if base == '-': base = None
+				index.append( (int(words[0]), words[1], base))
+			elif len(words) == 2:
+				# Written before objects were named after their base
+				index.append( (int(words[0]), words[1], ''))
+		f.close()
+		return index
+
+	# The versions backed up, oldest first, as (time, key)
+	def versions(self):
+		return [(when, key) for when, key, base in self._index()]
+
+	def _object(self, key, base):
+		if base == '': return os.path.join( self.directory, key + '.z')
+		return os.path.join( self.directory,
+			key + '-' + (base or 'full') + '.z')
+
+	# The text of a stored version.  texts holds the versions already
+	# read, and index the store's index, if they are at hand.
+	def read(self, key, texts=None, index=None):
+		if texts is None: texts = {}
+		if key in texts: return texts[key]
+		if index is None: index = self._index()
+		bases = {}
+		for when, k, base in index: bases[k] = base
+
+		# Follow the deltas up to a whole version, then back down
+		chain = []
+		while key not in texts:
+			f = open( self._object( key, bases[key]), 'rb')
+			data = zlib.decompress( f.read())
+			f.close()
+			if data[0] == 'F':
+				texts[key] = data[1:]
+				break
+			chain.append( (key, data[33:]))
+			key = data[1:33]
+		text = texts[key]
+		while chain:
+			key, delta = chain.pop()
+			text = apply_delta( text, delta)
+			texts[key] = text
+		return text
+
+	# Back up the given file, unless its text is the newest version
+	# already.  Returns the key of the version, or None.
+	def backup(self, filename=custom_file, now=None):
+		f = open( filename, 'rb')
+		text = f.read()
+		f.close()
+		return self.add( text, now)
+
+	def add(self, text, now=None):
+		if now is None: now = int(time.time())
+		key = md5.new( text).hexdigest()
+		versions = self.versions()
+		if versions and versions[-1][1] == key: return None
+
+		versions.append( (now, key))
+		self.repack( versions, {key: text})
+		return key
+
+	# The versions to keep, by the retention policy
+	def retain(self, versions):
+		kept = {}
+		for i in range( max( 0, len(versions) - keep_last), len(versions)):
+			kept[i] = 1
+		days = {}
+		weeks = {}
+		for i in range( len(versions) - 1, -1, -1):
+			when = time.localtime( versions[i][0])
+			day = time.strftime( '%Y%m%d', when)
+			week = time.strftime( '%Y%W', when)
+			if day not in days and len(days) < keep_days:
+				days[day] = 1
+				kept[i] = 1
+			if week not in weeks and len(weeks) < keep_weeks:
+				weeks[week] = 1
+				kept[i] = 1
+		return [versions[i] for i in range( len(versions)) if i in kept]
+
+	# Apply the retention policy, and store every version kept as a delta
+	# from the next newer one, the newest whole.  texts holds the text
+	# of any version not stored yet.
+	#
+	# The objects that change are written under new names, and only
+	# once they are all on disk does the new index replace the old one.
+	# A crash before that leaves the old index and all of its objects
+	# as they were; the objects no index refers to are removed by the
+	# next repack.
+	def repack(self, versions, texts=None):
+		if texts is None: texts = {}
+		if not os.path.isdir( self.directory): os.makedirs( self.directory)
+		versions = self.retain( versions)
+		index = self._index()
+
+		# The stored versions, by their newest backup, and their bases
+		order = []
+		for when, key in versions:
+			if key in order: order.remove( key)
+			order.append( key)
+		bases = {}
+		for i in range( len(order)):
+			bases[order[i]] = None
+			if i + 1 < len(order): bases[order[i]] = order[i + 1]
+
+		# Newest first, so that a delta is never written before its base
+		for i in range( len(order) - 1, -1, -1):
+			key = order[i]
+			base = bases[key]
+			if os.path.exists( self._object( key, base)): continue
+			text = self.read( key, texts, index)
+			data = 'F' + text
+			if base is not None:
+				delta = 'D' + base + make_delta(
+					self.read( base, texts, index), text)
+				if len(delta) < len(data): data = delta
+			write_file( self._object( key, base), zlib.compress( data, 9))
+
+		index = [(when, k, bases[k] or '-') for when, k in versions]
+		write_file( self.index_file,
+			''.join(["%d %s %s\n" % version for version in index]))
+
+		# Drop the versions no longer kept, and anything a crash left
+		used = {}
+		for key in order: used[os.path.basename( self._object( key,
+			bases[key]))] = 1
+		for name in os.listdir( self.directory):
+			if name in used: continue
+			if name[-2:] == '.z' or (name[-1:] == '~' and '.z.' in name):
+				os.remove( os.path.join( self.directory, name))
+		return versions
+
+	# Write a version back; the text it replaces is backed up first
+	def restore(self, key, filename=custom_file):
+		text = self.read( key)
+		if os.path.exists( filename): self.backup( filename)
+		write_file( filename, text)
+
+	# Fold the copies made before there was a store into it, and
+	# remove them.  Returns the number of copies.
+	def import_old(self):
+		if not os.path.isdir( self.directory): return 0
+		old = []
+		for name in os.listdir( self.directory):
+			if not name.endswith( old_backup_suffix): continue
+			try:
+				when = time.strptime( name[:-len(old_backup_suffix)],
+					old_backup_format)
+			except ValueError:
+				continue
+			old.append( (int(time.mktime( when)), name))
+		if not old: return 0
+		old.sort()
+
+		versions = self.versions()
+		texts = {}
+		for when, name in old:
+			f = open( os.path.join( self.directory, name), 'rb')
+			text = f.read()
+			f.close()
+			key = md5.new( text).hexdigest()
+			versions.append( (when, key))
+			texts[key] = text
+		versions.sort()
+
+		# Successive copies of the same text count once
+		merged = []
+		for version in versions:
+			if not merged or merged[-1][1] != version[1]:
+				merged.append( version)
+		self.repack( merged, texts)
+
+		for when, name in old:
+			os.remove( os.path.join( self.directory, name))
+		return len(old)
+
+def usage():
+	print "Usage: "+sys.argv[0]+" [-d backup-dir] [-r version [file]] [-import]"
+	print "Lists the backups of the Custom levelset, or restores one.\n"
+	sys.exit(1)
+
+if __name__ == '__main__':
+	directory = backup_dir
+	restore = None
+	target = custom_file
+	old = 0
+
+	args = sys.argv[1:]
+	try:
+		while args:
+			arg = args.pop(0)
+			if arg == '-d': directory = args.pop(0)
+			elif arg == '-r':
+				restore = int(args.pop(0))
+				if args and args[0][0] != '-': target = args.pop(0)
+			elif arg == '-import': old = 1
+			else: usage()
+	except (IndexError, ValueError):
+		usage()
+
+	store = BackupStore( directory)
+	if old:
+		print store.import_old(), "old copies imported"
+
+	versions = store.versions()
+	if restore is not None:
+		if restore < 1 or restore > len(versions): usage()
+		when, key = versions[restore - 1]
+		store.restore( key, target)
+		print "Restored the backup of", \
+			time.strftime( '%Y-%m-%d %H:%M', time.localtime( when)), "to", target
+	else:
+		texts = {}
+		for i in range( len(versions)):
+			when, key = versions[i]
+			text = store.read( key, texts)
+			print "%3d  %s  %s  %5d levels  %d bytes" % (i + 1,
+				time.strftime( '%Y-%m-%d %H:%M', time.localtime( when)),
+				key[:8], text.count( '\n|') / 6, len(text))
@@ -0,0 +1,357 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Steps many independent boards at once, for batch analysis of levels.
+# Needs NumPy, which the game itself does not.
+#
+# The marbles of all of the boards are kept together in NumPy arrays
+# (position, direction, color and board), and are moved together.  The
+# plain tiles, painters, filters, directors, shredders and teleporters
+# act on the marbles reaching their centres through lookups into per-board
+# grids of the tiles.  On a frame where a marble of a board reaches
+# anything else (a wheel, a buffer, a switch, a replicator, a trigger, a
+# stoplight, the launcher or the top of the board), that board moves its
+# marbles with the scalar Engine instead, so the results are the same as
+# stepping each Engine on its own.
+
+# Import Modules
+import numpy
+import pathological
+from pathological import tile_size, marble_size, wheel_margin, \
+	horiz_tiles, vert_tiles, board_width, holecenters, marble_steps, \
+	kind_tile, kind_wheel, kind_buffer, kind_painter, kind_filter, \
+	kind_director, kind_shredder, kind_switch, kind_replicator, \
+	kind_teleporter, kind_trigger, kind_stoplight
+
+# The kinds of tile applied with array operations, and the other kinds
+# that only act on marbles at their centres
+simple_kinds = (kind_tile, kind_painter, kind_filter, kind_director,
+	kind_shredder, kind_teleporter)
+center_kinds = (kind_switch, kind_replicator, kind_trigger, kind_stoplight)
+
+# Where wheels and buffers may act on a marble (see their affect_marble)
+wheel_entries = (wheel_margin - marble_size/2,
+	tile_size - wheel_margin + marble_size/2)
+wheel_holes = tuple(set([int(c) for hole in holecenters[0] for c in hole]))
+buffer_entries = (tile_size/2 - marble_size, tile_size/2 + marble_size)
+
+def kind_table(kinds):
+	table = numpy.zeros( max( pathological.tile_kinds.values()) + 1, bool)
+	for kind in kinds: table[kind] = True
+	return table
+
+is_simple = kind_table( simple_kinds)
+is_center = kind_table( center_kinds)
+
+# The direction Tile.affect_marble gives a marble at a tile's centre,
+# by the tile's paths and the marble's direction
+def make_turns():
+	class Probe: pass
+	turns = numpy.zeros( (16, 4), int)
+	for paths in range(16):
+		tile = pathological.Tile( paths)
+		for direction in range(4):
+			probe = Probe()
+			probe.direction = direction
+			pathological.Tile.affect_marble( tile, None, probe,
+				(tile_size/2, tile_size/2))
+			turns[paths, direction] = probe.direction
+	return turns
+
+tile_turns = make_turns()
+step_x = numpy.array([step[0] for step in marble_steps])
+step_y = numpy.array([step[1] for step in marble_steps])
+dir_x = numpy.array([0, 1, 0, -1])
+dir_y = numpy.array([-1, 0, 1, 0])
+
+# Whether nothing on a board will change but its marbles and timers,
+# until a marble reaches one of its tiles or it is given input
+def is_quiet(engine):
+	if engine.dirty_wheels: return 0
+	for tile in engine.animated_tiles:
+		if tile.kind == kind_wheel:
+			if tile.spinpos: return 0
+		elif tile.kind == kind_replicator:
+			if tile.pending: return 0
+		elif tile.countdown: return 0
+	return 1
+
+class BatchEngine:
+	# Takes a list of started Engines, which are stepped from then on
+	# through the BatchEngine.  Their marbles, frame counts and timers
+	# are only brought up to date by sync().
+	def __init__(self, engines):
+		self.engines = engines
+		count = len(engines)
+
+		# The tile grids
+		shape = (count, vert_tiles, horiz_tiles)
+		self.kind = numpy.zeros( shape, int)
+		self.paths = numpy.zeros( shape, int)
+		self.color = numpy.zeros( shape, int)
+		self.direction = numpy.zeros( shape, int)
+		self.dest_x = numpy.zeros( shape, int)
+		self.dest_y = numpy.zeros( shape, int)
+		for b in range( count):
+			for j in range( vert_tiles):
+				for i in range( horiz_tiles):
+					tile = engines[b].tiles[j][i]
+					self.kind[b, j, i] = tile.kind
+					self.paths[b, j, i] = tile.paths
+					if tile.kind in (kind_painter, kind_filter):
+						self.color[b, j, i] = tile.color
+					elif tile.kind == kind_director:
+						self.direction[b, j, i] = tile.direction
+					elif tile.kind == kind_teleporter:
+						# An unpaired teleporter is a plain track, as in
+						# Teleporter.affect_marble
+						if tile.other is None:
+							self.kind[b, j, i] = kind_tile
+						else:
+							self.dest_x[b, j, i], self.dest_y[b, j, i] = \
+								tile.other.rect.center
+
+		# The boards
+		self.pos_x = numpy.array([engine.pos[0] for engine in engines])
+		self.pos_y = numpy.array([engine.pos[1] for engine in engines])
+		self.frame = numpy.array([engine.frame for engine in engines])
+		self.launch_timeout = numpy.zeros( count, int)
+		self.board_timeout = numpy.zeros( count, int)
+		self.playing = numpy.zeros( count, bool)
+		self.busy = {}    # Boards whose tiles are animating
+
+		# The marbles, one slot each; slots of marbles that are gone
+		# are reused
+		self.x = numpy.zeros( 0, int)
+		self.y = numpy.zeros( 0, int)
+		self.dir = numpy.zeros( 0, int)
+		self.col = numpy.zeros( 0, int)
+		self.board = numpy.zeros( 0, int)
+		self.alive = numpy.zeros( 0, bool)
+		self.marbles = []          # The Marble object in each slot
+		self.free = []
+		self.slots = [{} for engine in engines] # id(marble): slot
+
+		for b in range( count): self._sync_in( b)
+
+	def _grow(self):
+		size = max( 16, 2 * len(self.marbles))
+		extra = size - len(self.marbles)
+		self.x = numpy.concatenate( (self.x, numpy.zeros( extra, int)))
+		self.y = numpy.concatenate( (self.y, numpy.zeros( extra, int)))
+		self.dir = numpy.concatenate( (self.dir, numpy.zeros( extra, int)))
+		self.col = numpy.concatenate( (self.col, numpy.zeros( extra, int)))
+		self.board = numpy.concatenate( (self.board, numpy.zeros( extra, int)))
+		self.alive = numpy.concatenate( (self.alive, numpy.zeros( extra, bool)))
+		self.free = range( size - 1, len(self.marbles) - 1, -1) + self.free
+		self.marbles += [None] * extra
+
+	def _release(self, slot):
+		self.alive[slot] = False
+		self.marbles[slot] = None
+		self.free.append( slot)
+
+	# Take in the state of a board after its Engine changed it.
+	# If new_only is set, only the marbles new to the board are read,
+	# as the others may be out of date.
+	def _sync_in(self, b, new_only=0):
+		engine = self.engines[b]
+		self.launch_timeout[b] = engine.launch_timeout
+		self.board_timeout[b] = engine.board_timeout
+		self.playing[b] = not engine.board_complete
+
+		known = self.slots[b]
+		current = {}
+		for marble in engine.marbles:
+			slot = known.pop( id(marble), None)
+			if slot is None:
+				if not self.free: self._grow()
+				slot = self.free.pop()
+				self.marbles[slot] = marble
+				self.board[slot] = b
+				self.alive[slot] = True
+			elif new_only:
+				current[id(marble)] = slot
+				continue
+			self.x[slot] = marble.x
+			self.y[slot] = marble.y
+			self.dir[slot] = marble.direction
+			self.col[slot] = marble.color
+			current[id(marble)] = slot
+		for slot in known.values(): self._release( slot)
+		self.slots[b] = current
+
+	# Bring the Engine of a board up to date
+	def _sync_out(self, b):
+		engine = self.engines[b]
+		engine.frame = int(self.frame[b])
+		engine.launch_timeout = int(self.launch_timeout[b])
+		engine.board_timeout = int(self.board_timeout[b])
+
+		slots = self.slots[b]
+		for marble in engine.marbles:
+			slot = slots[id(marble)]
+			marble.x = int(self.x[slot])
+			marble.y = int(self.y[slot])
+			marble.direction = int(self.dir[slot])
+			marble.color = int(self.col[slot])
+
+	# Bring all of the Engines up to date
+	def sync(self):
+		for b in range( len(self.engines)): self._sync_out( b)
+
+	# The boards still being played
+	def active(self):
+		return list(numpy.nonzero( self.playing)[0])
+
+	# Play one frame on every board that is not complete.  The events
+	# are a dictionary of Engine events by board, as for Engine.step.
+	def step(self, events=None):
+		engines = self.engines
+		playing = self.playing.copy()
+		if not playing.any(): return
+
+		# The boards handed to their Engines for this frame
+		busy = self.busy
+		self.busy = {}
+		for b in busy: self._sync_out( b)
+
+		if events is None: events = {}
+		for b, board_events in events.items():
+			if not playing[b]: continue
+			if b not in busy:
+				self._sync_out( b)
+				busy[b] = 1
+			for event in board_events: engines[b].handle_event( event)
+			self._sync_in( b)
+		self.frame[playing] += 1
+
+		# Move the marbles, and find the ones reaching something
+		s = numpy.nonzero( self.alive & playing[self.board])[0]
+		board = self.board[s]
+		dir = self.dir[s]
+		x = self.x[s] + step_x[dir]
+		y = self.y[s] + step_y[dir]
+		cx = x - self.pos_x[board]
+		cy = y - self.pos_y[board]
+
+		# The tile acting on each marble, as in Engine.affect_marble
+		top = cy < 0
+		ex = numpy.where( top, cx, cx + dir_x[dir] * (marble_size/2))
+		ey = numpy.where( top, cy + marble_size,
+			cy + dir_y[dir] * (marble_size/2))
+		tx = ex // tile_size
+		ty = ey // tile_size
+		rx = cx - tx * tile_size
+		ry = cy - ty * tile_size
+		inside = (tx >= 0) & (tx < horiz_tiles) & (ty >= 0) & (ty < vert_tiles)
+		tx = numpy.clip( tx, 0, horiz_tiles - 1)
+		ty = numpy.clip( ty, 0, vert_tiles - 1)
+		kind = self.kind[board, ty, tx]
+		center = (rx == tile_size/2) & (ry == tile_size/2)
+
+		launcher = top & (dir_x[dir] != 0)
+		at_launcher = launcher & ((cx == marble_size/2) |
+			(cx == board_width - marble_size/2) |
+			((cx % tile_size == tile_size/2) & (cx < board_width)))
+		at_wheel = (kind == kind_wheel) & (
+			numpy.in1d( rx, wheel_entries) | numpy.in1d( ry, wheel_entries) |
+			(numpy.in1d( rx, wheel_holes) & numpy.in1d( ry, wheel_holes)))
+		at_buffer = (kind == kind_buffer) & (center |
+			numpy.in1d( rx, buffer_entries) | numpy.in1d( ry, buffer_entries))
+		scalar = at_launcher | (~launcher & ((cy == marble_size/2) |
+			~inside | at_wheel | at_buffer | (is_center[kind] & center)))
+
+		# Boards with a marble reaching anything else are left to their
+		# Engines for this frame
+		scalar_boards = numpy.unique( board[scalar])
+		vector = ~numpy.in1d( board, scalar_boards)
+		s = s[vector]
+		self.x[s] = x[vector]
+		self.y[s] = y[vector]
+
+		# Apply the simple tiles
+		hit = (center & ~top & is_simple[kind])[vector]
+		if hit.any():
+			s = s[hit]
+			board = board[vector][hit]
+			tx = tx[vector][hit]
+			ty = ty[vector][hit]
+			kind = kind[vector][hit]
+			old = dir[vector][hit]
+			col = self.col[s]
+			color = self.color[board, ty, tx]
+			turn = tile_turns[self.paths[board, ty, tx], old]
+
+			dir = numpy.where( (kind == kind_tile) | (kind == kind_painter) |
+				(kind == kind_filter), turn, old)
+			dir = numpy.where( (kind == kind_filter) & (col != color) &
+				(col != 8), old ^ 2, dir)
+			dir = numpy.where( kind == kind_director,
+				self.direction[board, ty, tx], dir)
+			self.dir[s] = dir
+			self.col[s] = numpy.where( kind == kind_painter, color, col)
+
+			teleport = kind == kind_teleporter
+			self.x[s[teleport]] = self.dest_x[board, ty, tx][teleport]
+			self.y[s[teleport]] = self.dest_y[board, ty, tx][teleport]
+
+			for slot in s[kind == kind_shredder]:
+				b = self.board[slot]
+				marble = self.marbles[slot]
+				engines[b].marbles.remove( marble)
+				del self.slots[b][id(marble)]
+				self._release( slot)
+
+		for b in scalar_boards:
+			engine = engines[b]
+			if b not in busy:
+				self._sync_out( b)
+				busy[b] = 1
+			for marble in engine.marbles[:]:
+				marble.update( engine)
+
+		# Animate the tiles and count down on the busy boards
+		for b in busy:
+			engine = engines[b]
+			engine.end_step()
+			self._sync_in( b, b not in scalar_boards)
+			if not engine.board_complete and not is_quiet( engine):
+				self.busy[b] = 1
+
+		# Only count down on the others
+		quiet = playing.copy()
+		quiet[busy.keys()] = False
+		for timeout, rc in ((self.launch_timeout, -1),
+			(self.board_timeout, -2)):
+			counting = quiet & (timeout > 0)
+			timeout[counting] -= 1
+			for b in numpy.nonzero( counting & (timeout == 0))[0]:
+				engines[b].board_complete = rc
+				self.playing[b] = False
+
+	# Play the given number of frames without input, or until every
+	# board is complete
+	def advance(self, frames):
+		for i in range( frames):
+			if not self.playing.any(): break
+			self.step()
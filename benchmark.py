@@ -0,0 +1,273 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Times the marble physics with the headless Engine, and compares the
+# results with a stored baseline so that slowdowns are noticed.
+#
+# A few representative boards are picked from a levelset: the one with
+# the most wheels, and the ones with the most teleporters, replicators
+# and buffers.  Each board is warmed up until marbles are rolling, then
+# the same frames are played over again with seeded moves on its
+# wheels.  Whole frames are timed as ticks per second, and the hot
+# methods are timed one at a time by wrapping them with a stopwatch.
+# Method times include the methods they call.
+
+# Import Modules
+import os, sys, random, timeit, gc
+import pathological, solver
+from pathological import Engine, Game, LevelError, Marble, Tile, Wheel, \
+	Buffer, Replicator, Teleporter
+
+# Benchmark defaults
+levelset_file = os.path.join('circuits', 'all-boards')
+bench_seed = 0           # Seed of the games and of the moves
+warmup_frames = 500      # Frames played before timing starts
+bench_frames = 5000      # Frames timed per run
+move_interval = 20       # Frames between two moves
+repeats = 3              # Runs per measurement; the best one counts
+tolerance = 10           # Slowdown in percent reported as a regression
+baseline_file = os.path.join(pathological.cache_dir, 'benchmark-baseline')
+baseline_magic = 'pathological-benchmark 1'
+
+timer = timeit.default_timer
+
+# The boards to time: (name, tile class counted to pick the board)
+scenarios = [
+	('wheels', Wheel),
+	('teleporter', Teleporter),
+	('replicator', Replicator),
+	('buffer', Buffer),
+	]
+
+# The methods to time: (name, class, method name)
+targets = [
+	('Marble.update', Marble, 'update'),
+	('Engine.affect_marble', Engine, 'affect_marble'),
+	('Wheel.maybe_complete', Wheel, 'maybe_complete'),
+	]
+for cls in [Tile, Wheel, Buffer, pathological.Painter, pathological.Filter,
+	pathological.Director, pathological.Shredder, pathological.Switch,
+	Replicator, Teleporter]:
+	if 'affect_marble' in cls.__dict__:
+		targets.append( (cls.__name__+'.affect_marble', cls, 'affect_marble'))
+
+def count_tiles(engine, cls):
+	count = 0
+	for row in engine.tiles:
+		for tile in row:
+			if isinstance( tile, cls): count += 1
+	return count
+
+# Pick the level with the most tiles of each scenario's class; levels
+# that do not load are skipped.  Returns a list of (name, level).
+def pick_levels(circuit):
+	numlevels = len(pathological.load_levelset( os.path.join(*circuit)).levels)
+	best = {}
+	for level in range( numlevels):
+		try:
+			engine = Engine( Game( None, circuit, None, level, bench_seed))
+		except LevelError, error:
+			print "Skipping", error
+			continue
+		for name, cls in scenarios:
+			count = count_tiles( engine, cls)
+			if count > best.get( name, (0, None))[0]:
+				best[name] = (count, level)
+
+	result = []
+	for name, cls in scenarios:
+		if name in best: result.append( (name, best[name][1]))
+	return result
+
+# A started board with marbles rolling, and the moves to play on it.
+# The moves are picked at random among the solver's useful moves while
+# the board is warmed up and played once, and are kept as a dictionary
+# of the events for each frame, so that every timed run is the same.
+def make_board(circuit, level):
+	rng = random.Random( bench_seed)
+	engine = Engine( Game( None, circuit, None, level, bench_seed))
+	engine.start()
+
+	moves = {}
+	board = engine
+	for i in range( warmup_frames + bench_frames):
+		if i == warmup_frames: engine = board.clone()
+		if board.board_complete: break
+		events = ()
+		if board.frame % move_interval == 0:
+			events = rng.choice( solver.moves( board))[:1]
+			if events: moves[board.frame + 1] = events
+		board.step( events)
+	return engine, moves
+
+# Play the benchmark frames on a copy of the board.
+# Returns the number of frames played and the time they took.
+def play(engine, moves):
+	engine = engine.clone()
+	first = engine.frame
+	gc.disable()
+	start = timer()
+	for i in range( bench_frames):
+		if engine.board_complete: break
+		engine.step( moves.get( engine.frame + 1, ()))
+	elapsed = timer() - start
+	gc.enable()
+	return engine.frame - first, elapsed
+
+# Wrap a method so that the calls and the time spent in it are counted.
+# Returns the totals, as a list of [calls, seconds].
+def instrument(cls, name):
+	method = cls.__dict__[name]
+	totals = [0, 0.0]
+	def timed(*args):
+		start = timer()
+		result = method(*args)
+		totals[1] += timer() - start
+		totals[0] += 1
+		return result
+	setattr( cls, name, timed)
+	return totals
+
+def restore(cls, name, method):
+	setattr( cls, name, method)
+
+# The time the stopwatch itself adds to every call
+def stopwatch_overhead():
+	class Empty:
+		def method(self): pass
+	totals = instrument( Empty, 'method')
+	empty = Empty()
+	for i in xrange( 100000): empty.method()
+	return totals[1] / totals[0]
+
+# Time one scenario.  Returns a list of (name, rate, unit) where the
+# rates are ticks or calls per second; higher is better.
+def run_scenario(name, engine, moves, overhead):
+	results = []
+
+	best = None
+	for i in range( repeats):
+		frames, elapsed = play( engine, moves)
+		if frames and (best is None or elapsed < best[1]):
+			best = (frames, elapsed)
+	if best is None: return results
+	results.append( (name+'/frame', best[0] / best[1], 'ticks/s'))
+
+	for target, cls, method_name in targets:
+		method = cls.__dict__[method_name]
+		best = None
+		for i in range( repeats):
+			totals = instrument( cls, method_name)
+			try:
+				play( engine, moves)
+			finally:
+				restore( cls, method_name, method)
+			if totals[0] == 0: break
+			elapsed = max( totals[1] - totals[0] * overhead, 1e-9)
+			if best is None or elapsed < best[1]:
+				best = (totals[0], elapsed)
+		if best is not None:
+			results.append( (name+'/'+target, best[0] / best[1], 'calls/s'))
+
+	return results
+
+def load_baseline(filename):
+	baseline = {}
+	try:
+		f = open( filename)
+	except IOError:
+		return None
+	lines = f.read().split('\n')
+	f.close()
+	if lines[0] != baseline_magic: return None
+	for line in lines[1:]:
+		words = line.split()
+		if len(words) == 2: baseline[words[0]] = float(words[1])
+	return baseline
+
+def save_baseline(filename, results):
+	dir = os.path.dirname( filename)
+	if dir and not os.path.isdir( dir): os.makedirs( dir)
+	f = open( filename, "w")
+	f.write( baseline_magic + "\n")
+	for name, rate, unit in results:
+		f.write( name + " " + `rate` + "\n")
+	f.close()
+
+# Print the results next to the baseline.
+# Returns the number of regressions.
+def report(results, baseline):
+	regressions = 0
+	for name, rate, unit in results:
+		line = "%-36s %12.0f %-7s" % (name, rate, unit)
+		if baseline is not None and name in baseline:
+			change = 100.0 * (rate / baseline[name] - 1)
+			line += " %+6.1f%%" % change
+			if change < -tolerance:
+				line += "  REGRESSION"
+				regressions += 1
+		print line
+	return regressions
+
+def usage():
+	print "Usage: "+sys.argv[0]+ \
+		" [-n frames] [-r repeats] [-tol percent] [-b baseline-file]" + \
+		" [-save] [levelset-file]\n"
+	sys.exit(1)
+
+if __name__ == '__main__':
+	save = 0
+	args = sys.argv[1:]
+	try:
+		while args:
+			arg = args.pop(0)
+			if arg == '-n': bench_frames = int(args.pop(0))
+			elif arg == '-r': repeats = int(args.pop(0))
+			elif arg == '-tol': tolerance = float(args.pop(0))
+			elif arg == '-b': baseline_file = args.pop(0)
+			elif arg == '-save': save = 1
+			elif arg[0] == '-': usage()
+			else: levelset_file = arg
+	except (IndexError, ValueError):
+		usage()
+
+	pathological.setup_headless()
+	circuit = os.path.split( levelset_file)
+
+	baseline = load_baseline( baseline_file)
+	overhead = stopwatch_overhead()
+	results = []
+	for name, level in pick_levels( circuit):
+		engine, moves = make_board( circuit, level)
+		print "Timing '"+name+"': level", level + 1, "("+engine.name+")"
+		results += run_scenario( name, engine, moves, overhead)
+	print
+
+	regressions = report( results, baseline)
+
+	if save or baseline is None:
+		save_baseline( baseline_file, results)
+		print "\nBaseline saved to", baseline_file
+	if regressions:
+		print "\n" + `regressions` + " measurements are more than " + \
+			`tolerance` + "% slower than the baseline"
+		sys.exit(1)
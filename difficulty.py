@@ -0,0 +1,239 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Estimates how hard the levels of levelsets are, by playing each level
+# many times with the headless Engine and a simulated player.
+#
+# Every play deals different marbles (the game seed changes from one
+# play to the next), and the player picks one of the solver's useful
+# moves every decision_interval frames: at random, or the one that
+# looks best a move ahead.  The completion rate, the median time to
+# complete and the spread of the scores (as Game.play counts them,
+# bonuses included) are reported for each level, and the sets are
+# ordered by their average completion rate, then by their scores.
+#
+# The levels are played in rounds, each doubling the plays of the
+# levels still going, and a level stops once its completion rate is
+# known closely enough: most levels are nearly always or nearly never
+# completed, and need far fewer plays than the ones in between.
+
+# Import Modules
+import os, sys, math, random, multiprocessing
+import pathological, solver
+from pathological import Engine, Game, LevelError, frames_per_sec, \
+	levelset_files
+
+# Estimator defaults
+plays = 400              # Most plays of each level
+first_plays = 50         # Plays of each level in the first round
+precision = 0.05         # Completion rate error at which a level stops
+decision_interval = 50   # Frames between two moves
+policy = 'random'        # 'random' or 'greedy'
+first_seed = 0           # Seed of the first play; the others follow
+chunk_size = 25          # Plays per task handed to a worker
+
+# Pick the player's next move
+def choose_move(engine, rng, policy, interval):
+	moves = solver.moves( engine)
+	if policy == 'random': return rng.choice( moves)
+
+	# Greedy: try every move and keep one of the best
+	best = []
+	for move in moves:
+		board = engine.clone()
+		solver.play_move( board, move, interval)
+		score = (board.board_complete, solver.evaluate( board))
+		if not best or score > best[0][0]: best = [(score, move)]
+		elif score == best[0][0]: best.append( (score, move))
+	return rng.choice( best)[1]
+
+# Play a level once.  Returns (board_complete, frames, score).
+def play(circuit, level, seed, policy, interval):
+	game = Game( None, circuit, None, level, seed)
+	engine = Engine( game)
+	engine.start()
+	rng = random.Random( seed)
+
+	while not engine.board_complete:
+		move = choose_move( engine, rng, policy, interval)
+		solver.play_move( engine, move, interval)
+
+	if engine.board_complete > 0:
+		bonus = game.level_bonus( engine)
+		game.increase_score( bonus[1] + bonus[3])
+	return (engine.board_complete, engine.frame, game.score)
+
+# Play a chunk of plays of a level; run in the worker processes.
+# Returns (filename, level, results, problem), where problem says what
+# is wrong with a level that does not load, or is None.
+def play_chunk(args):
+	filename, level, seed, count, policy, interval = args
+	circuit = os.path.split( filename)
+	results = []
+	try:
+		for i in range( count):
+			results.append( play( circuit, level, seed + i, policy, interval))
+	except LevelError, error:
+		return (filename, level, [], error.problem)
+	return (filename, level, results, None)
+
+def init_worker():
+	pathological.setup_headless()
+
+# The value below which the given fraction of the sorted values lie
+def percentile(values, fraction):
+	if not values: return 0
+	return values[min( int(fraction * len(values)), len(values) - 1)]
+
+# How far off the completion rate of the plays may be: the half width
+# of its 95% confidence interval, by Wilson's score interval, which
+# holds up for rates near 0 or 1 too
+def rate_error(results):
+	n = float(len(results))
+	if not n: return 1.0
+	rate = len([rc for rc, frames, score in results if rc > 0]) / n
+	z = 1.96
+	return z * math.sqrt( rate * (1 - rate) / n + z * z / (4 * n * n)) / \
+		(1 + z * z / n)
+
+# Summarize the plays of a level.
+# Returns (completion rate, median seconds to complete, sorted scores).
+def summarize(results):
+	times = [float(frames) / frames_per_sec
+		for rc, frames, score in results if rc > 0]
+	times.sort()
+	scores = [score for rc, frames, score in results]
+	scores.sort()
+	return (float(len(times)) / len(results), percentile( times, 0.5),
+		scores)
+
+def format_level(level, name, summary):
+	rate, median_time, scores = summary
+	line = "%3d  %-28s %4d plays %5.1f%% completed" % (level + 1, name[:28],
+		len(scores), 100 * rate)
+	if rate: line += ", median %5.1fs" % median_time
+	else: line += "               "
+	line += "  scores %d / %d / %d / %d / %d\n" % tuple([percentile(
+		scores, fraction) for fraction in (0, 0.25, 0.5, 0.75, 1)])
+	return line
+
+def usage():
+	print "Usage: "+sys.argv[0]+ \
+		" [-j jobs] [-n plays] [-e percent] [-i interval]" + \
+		" [-p random|greedy] [-s seed] [-o report]" + \
+		" levelset-file|levelset-dir ...\n"
+	sys.exit(1)
+
+if __name__ == '__main__':
+	jobs = multiprocessing.cpu_count()
+	report = None
+	names = []
+
+	args = sys.argv[1:]
+	try:
+		while args:
+			arg = args.pop(0)
+			if arg == '-j': jobs = int(args.pop(0))
+			elif arg == '-n': plays = int(args.pop(0))
+			elif arg == '-e': precision = float(args.pop(0)) / 100
+			elif arg == '-i': decision_interval = int(args.pop(0))
+			elif arg == '-p': policy = args.pop(0)
+			elif arg == '-s': first_seed = int(args.pop(0))
+			elif arg == '-o': report = args.pop(0)
+			elif arg[0] == '-': usage()
+			else: names.append( arg)
+	except (IndexError, ValueError):
+		usage()
+	if not names or policy not in ('random', 'greedy') or plays < 1: usage()
+
+	init_worker()
+	if jobs > 1: pool = multiprocessing.Pool( jobs, init_worker)
+	files = levelset_files( names)
+	levelsets = {}
+	results = {}
+	problems = {}
+	going = []
+	for filename in files:
+		levelsets[filename] = pathological.load_levelset( filename).levels
+		for level in range( len(levelsets[filename])):
+			results[(filename, level)] = []
+			going.append( (filename, level))
+
+	# Play the levels still going up to count plays each, until every
+	# level is known closely enough or has had all its plays
+	count = min( first_plays, plays)
+	while going:
+		tasks = []
+		for filename, level in going:
+			end = first_seed + count
+			for seed in range( first_seed + len(results[(filename, level)]),
+				end, chunk_size):
+				tasks.append( (filename, level, seed,
+					min( chunk_size, end - seed), policy, decision_interval))
+
+		if jobs > 1: chunks = pool.imap_unordered( play_chunk, tasks)
+		else: chunks = map( play_chunk, tasks)
+		for filename, level, chunk, problem in chunks:
+			results[(filename, level)].extend( chunk)
+			if problem is not None: problems[(filename, level)] = problem
+
+		going = [key for key in going if key not in problems and
+			count < plays and rate_error( results[key]) > precision]
+		count = min( 2 * count, plays)
+
+	if report is None: f = sys.stdout
+	else: f = open( report, "w")
+	f.write( "Up to " + `plays` + " plays of each level, until its " +
+		"completion rate is known to within %g%%, " % (100 * precision) +
+		policy + " player, a move every " + `decision_interval` +
+		" frames\n")
+	f.write( "Scores: lowest / 25% / median / 75% / highest\n")
+
+	# The average completion rate and median score of each set
+	averages = []
+	for filename in files:
+		f.write( "\nLevelset: " + filename + "\n")
+		rate = 0.0
+		score = 0.0
+		# The levels that do not load are left out of the averages
+		numlevels = len(levelsets[filename])
+		valid = numlevels - len([key for key in problems if key[0] == filename])
+		for level in range( numlevels):
+			name = levelsets[filename][level][0][0] or "Unnamed"
+			if (filename, level) in problems:
+				f.write( "%3d  %-28s invalid level: %s\n" % (level + 1,
+					name[:28], problems[(filename, level)]))
+				continue
+			summary = summarize( results[(filename, level)])
+			f.write( format_level( level, name, summary))
+			rate += summary[0] / valid
+			score += float(percentile( summary[2], 0.5)) / valid
+		if valid: averages.append( (rate, score, filename))
+
+	# Easiest first; the scores tell apart the sets rarely completed
+	averages.sort()
+	averages.reverse()
+	f.write( "\nLevelsets from easiest to hardest " +
+		"(average completion rate, average median score):\n")
+	for rate, score, filename in averages:
+		f.write( "%5.1f%% %6.0f  %s\n" % (100 * rate, score, filename))
+	if report is not None: f.close()
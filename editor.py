@@ -22,7 +22,7 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 # Import Modules
 import os, pygame, random, time, math, re, sys, md5, getpass
-from shutil import copyfile
+import backups, pathological
 from pygame.locals import *
 
 # Parse the command line
@@ -234,6 +234,92 @@ def countLevels(customSet=False):
 
 	return numlevels
 
+# The levels of a levelset file, found by their byte offsets, so that one
+# level can be replaced or added without going through the others line
+# by line.  A level runs from its first setting (or row) to the border
+# and blank lines after its last row; anything between two levels, such
+# as comments, is kept as it is.  The file is always written whole to a
+# temporary file which then replaces it, so it is never left half saved.
+class LevelStore:
+	def __init__(self, filename):
+		self.filename = filename
+		self.spans = []
+		self.stamp = None
+
+	# Find the levels again, unless the file is the one last seen
+	def _index(self):
+		stat = os.stat( self.filename)
+		if (stat.st_mtime, stat.st_size) == self.stamp: return
+
+		self.spans = []
+		start = None
+		end = 0
+		rows = 0
+		pos = 0
+		f = open( self.filename, 'rb')
+		for line in f:
+			text = line.strip()
+			if rows == vert_tiles:
+				if text == '' or text[0] == '+':
+					end = pos + len(line)
+					pos += len(line)
+					continue
+				self.spans.append( (start, end))
+				start = None
+				rows = 0
+			if start is None and text != '' and text[0] != '#': start = pos
+			if line[0] == '|':
+				rows += 1
+				if rows == vert_tiles: end = pos + len(line)
+			pos += len(line)
+		f.close()
+		if rows == vert_tiles: self.spans.append( (start, end))
+		self.stamp = (stat.st_mtime, stat.st_size)
+
+	def count(self):
+		self._index()
+		return len(self.spans)
+
+	# Replace a level with the given text, or add it at the end if level
+	# is -1.  Returns the number of the level.
+	def save_level(self, level, text):
+		self._index()
+		f = open( self.filename, 'rb')
+		data = f.read()
+		f.close()
+
+		if level < 0 or level >= len(self.spans):
+			if data and data[-1] != '\n': data += '\n'
+			level = len(self.spans)
+			self.spans.append( (len(data), len(data)))
+		start, end = self.spans[level]
+
+		# Write to a temporary file first, so that the levelset is
+		# never left half written
+		tmpname = self.filename + '.' + `os.getpid()` + '~'
+		f = open( tmpname, 'wb')
+		f.write( data[:start])
+		f.write( text)
+		f.write( data[end:])
+		f.flush()
+		os.fsync( f.fileno())
+		f.close()
+		if sys.platform[0:3] == 'win' and os.path.exists( self.filename):
+			os.remove( self.filename)
+		os.rename( tmpname, self.filename)
+
+		# Move the levels after this one along
+		delta = len(text) - (end - start)
+		self.spans[level] = (start, start + len(text))
+		for i in range( level + 1, len(self.spans)):
+			self.spans[i] = (self.spans[i][0] + delta, self.spans[i][1] + delta)
+		stat = os.stat( self.filename)
+		self.stamp = (stat.st_mtime, stat.st_size)
+		return level
+
+# All modified levels go in the custom set
+customStore = LevelStore( os.path.join('user_circuits', 'Custom'))
+
 # A better tick function
 next_frame = pygame.time.get_ticks()
 def my_tick( frames_per_sec):
@@ -1106,29 +1192,16 @@ class Board:
 		for marble in self.marbles: 
 			marblesToSave[marble.tilePos] = (marble.color,marble.direction)
 		
-		# Open/read file
+		# Levels from other sets are added at the end of the custom set
 		if levelset!='Custom' and self.savedFromDefaultSet==False:
-			customLevelsNum = countLevels(True)
-			self.level = customLevelsNum
+			self.level = customStore.count()
 			self.savedFromDefaultSet=True
 			self.levelConfig_drawn = 0
+		edit = self.level != -1
+
+		# Put the level text together before anything is written
+		out = []
 
-		# All modified levels go in custom-set
-		filename = os.path.join('user_circuits', 'Custom')
-		f = open(filename,'r+')
-		lines = f.readlines()
-		if self.level == -1: edit=False
-		else:
-			edit=True
-			f.seek(0)
-			f.truncate()
-			l=0
-			# re-write levels before
-			for line in lines:
-				if l==16*self.level: break
-				f.write(line)
-				l+=1
-        
 		# Write level header
 		levelColors = ','.join(map(str,self.colors))
 		header = "name="+self.name+"\nauthor="+self.author \
@@ -1136,7 +1209,7 @@ class Board:
 			+"\nmaxmarbles="+str(self.live_marbles_limit)+"\ncolors="+levelColors \
 			+"\nstoplight="+stoplightColors
 		header += "\n+---+---+---+---+---+---+---+---+\n"
-		f.write(header)
+		out.append(header)
 		
 		# Write level tiles
 		for y in range(6):
@@ -1145,59 +1218,72 @@ class Board:
 				tileType = tile.__class__.__name__
 				path = tile.paths
 				if path > 9: path = chr(path+ ord('a') - 10)
-				f.write('|')
+				out.append('|')
 				if tileType == 'Director':
-					f.write(str(directionsSymbols[tile.direction])+str(path)+' ')
+					out.append(str(directionsSymbols[tile.direction])+str(path)+' ')
 				elif tileType == 'Switch': 
-					f.write(str(directionsSymbols[tile.curdir])+str(path)+ \
+					out.append(str(directionsSymbols[tile.curdir])+str(path)+ \
 						str(directionsSymbols[tile.otherdir]))
 				elif tileType == 'Filter' or tileType == 'Painter':
-					f.write(tilesSymbols[tileType]+str(path)+str(tile.color))
+					out.append(tilesSymbols[tileType]+str(path)+str(tile.color))
 				elif tileType == 'Trigger' or tileType == 'Stoplight':
-					f.write(tilesSymbols[tileType]+'  ')
+					out.append(tilesSymbols[tileType]+'  ')
 				elif tileType == 'Tile':
 					# Empty tile
-					if path==0: f.write('   ')
+					if path==0: out.append('   ')
 					# Path with marble
 					elif (x,y) in marblesToSave.keys(): 
-						f.write(str(marblesToSave[(x,y)][0])+str(path)+ \
+						out.append(str(marblesToSave[(x,y)][0])+str(path)+ \
 							str(directionsSymbols[marblesToSave[(x,y)][1]]))
 					# Path
-					else: f.write(' '+str(path)+' ')
+					else: out.append(' '+str(path)+' ')
 				elif tileType == 'Buffer':
-					f.write(tilesSymbols[tileType]+str(path))
-					if tile.marble == -1: f.write(' ')
-					else: f.write(str(tile.marble))
+					out.append(tilesSymbols[tileType]+str(path))
+					if tile.marble == -1: out.append(' ')
+					else: out.append(str(tile.marble))
 				elif tileType == 'Teleporter':
 					label = tile.label
 					if isinstance(label,(int)) and label > 9: 
 						label = chr(label+ ord('a') - 10)
-					f.write(tilesSymbols[tileType]+str(path)+str(label))
+					out.append(tilesSymbols[tileType]+str(path)+str(label))
 				elif tileType == 'Replicator':
-					f.write(tilesSymbols[tileType]+str(path)+str(tile.count))
+					out.append(tilesSymbols[tileType]+str(path)+str(tile.count))
 				else:
-					f.write(tilesSymbols[tileType]+str(path)+" ")
+					out.append(tilesSymbols[tileType]+str(path)+" ")
 				x+=1
-				if x==8:f.write('|')
-			f.write("\n")
+				if x==8:out.append('|')
+			out.append("\n")
 			y+=1
 
 		footer = "+---+---+---+---+---+---+---+---+\n\n"
-		f.write(footer)
-		
-		if edit:
-			# Existing level: re-write levels after
-			for l in range(16*self.level+16,len(lines)):
-				f.write(lines[l])
-		else:
+		out.append(footer)
+
+		# Check that marbles can get into every wheel
+		tiles = pathological.compile_levels(''.join(out))[0][1]
+		unreachable = pathological.PathGraph(tiles).unreachable_wheels
+		if unreachable:
+			play_sound(filter_admit)
+			msg = "No marble can ever get into the wheel"
+			if len(unreachable) > 1: msg += "s"
+			msg += " at (column, row):\n"
+			msg += ', '.join(["(%d, %d)" % (x+1, y+1) for x, y in unreachable])
+			self.warning("WARNING\n"+msg)
+
+		# Only the bytes of this level change in the file
+		try:
+			newLevelNum = customStore.save_level(self.level, ''.join(out))
+		except (IOError, OSError), message:
+			play_sound(filter_admit)
+			self.warning("WARNING\nLevel not saved: "+str(message))
+			return
+
+		if not edit:
 			# New level: set level number / update display
-			newLevelNum = len(lines)/16
 			self.level = newLevelNum
 			if levelset == 'Custom': game.level = newLevelNum
 			game.numlevels += 1
 			self.levelConfig_drawn = 0
-			
-		f.close()
+
 		play_sound(change_color)
 		self.warning("SUCCESS\nLevel saved in custom set")
 		
@@ -1902,11 +1988,14 @@ def setup_everything():
 	if not pygame.font: print 'Warning, fonts disabled'
 	if not pygame.mixer: print 'Warning, sound disabled'
 	
-	# Backup Custom levelset in case anything goes wrong (TODO: cleanup)
-	date = time.strftime("%Y%m%d-%H:%M")
-	src = os.path.join('user_circuits', 'Custom')
-	dst = os.path.join('user_circuits', 'backups', date+'_Custom')
-	copyfile(src, dst)
+	# Backup Custom levelset in case anything goes wrong; unchanged sets
+	# are not stored again, and old backups are thinned out
+	try:
+		store = backups.BackupStore()
+		store.import_old()
+		if os.path.exists(backups.custom_file): store.backup()
+	except (IOError, OSError), message:
+		print "Warning, could not backup the Custom levelset:", message
 
 	set_video_mode()
 	load_sounds()
@@ -0,0 +1,150 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Finds hints for the level being played, without holding up the game.
+#
+# The search runs on a worker process.  The game sends it the recording
+# of the level so far; the worker plays it back without a display, lets
+# the board run on for as long as the search may take (the player's
+# board does the same meanwhile), and searches from there with the
+# solver.  It then plays the plan found from the frame asked about,
+# and answers with the next move of the plan at every frame on the way,
+# by board key.  The game keeps these in a table, so asking again
+# anywhere along the plan is answered without searching.
+
+# Import Modules
+import signal, multiprocessing
+import pathological, solver
+from pathological import tile_size, frames_per_sec
+
+# Search settings
+search_time = 2          # Seconds of search per hint
+decision_interval = 50   # Frames between two moves
+beam_width = 4           # Boards kept after each decision
+
+# A compact hash of the board state.  Rolling marbles only count by the
+# tile they are in, so that the key stays the same for a few frames.
+def board_key(engine):
+	key = []
+	for wheel in engine.wheels:
+		key.append( (wheel.completed, wheel.spinpos, tuple(wheel.marbles)))
+	marbles = [(marble.x / tile_size, marble.y / tile_size,
+		marble.direction, marble.color) for marble in engine.marbles]
+	marbles.sort()
+	key.extend( marbles)
+	if engine.trigger is not None:
+		key.append( engine.trigger.marbles and tuple(engine.trigger.marbles))
+	if engine.stoplight is not None:
+		key.append( engine.stoplight.current)
+	return hash( tuple(key))
+
+# Answer a request from the game: (serial, recording, frame, lead).
+# Returns (serial, table), where table maps board keys to the next move
+# (an Engine event), or to None when no move is needed.
+def search(request):
+	serial, recording, frame, lead = request
+	replay = pathological.Replay()
+	replay.circuit, replay.level, replay.gamestart, replay.score, \
+		replay.lives, replay.seed, replay.events = recording
+	engine = replay.run( frame)[0]
+
+	board = engine.clone()
+	board.advance( lead)
+	history = []
+	if not board.board_complete:
+		board, history = solver.solve( board, decision_interval,
+			beam_width, search_time)[1:3]
+
+	# Play the plan, remembering the next move at every frame
+	table = {}
+	while 1:
+		key = board_key( engine)
+		if history: table.setdefault( key, history[0][1])
+		else: table.setdefault( key, None)
+		if engine.frame >= board.frame or engine.board_complete: break
+
+		if history and history[0][0] == engine.frame + 1:
+			engine.step( (history.pop(0)[1],))
+		else:
+			engine.step()
+	return (serial, table)
+
+def worker(conn):
+	# The game's signal handlers came along with the fork; the worker
+	# has to stop when it is told to
+	signal.signal( signal.SIGTERM, signal.SIG_DFL)
+	signal.signal( signal.SIGINT, signal.SIG_IGN)
+	pathological.sound_on = 0
+	pathological.setup_headless()
+	while 1:
+		try:
+			request = conn.recv()
+		except EOFError:
+			return
+		conn.send( search( request))
+
+# The game's side of the hints: the worker process, started on the first
+# request, and the table of the moves it found.
+class HintEngine:
+	def __init__(self):
+		self.conn = None
+		self.table = {}
+		self.board = None
+		self.serial = 0
+		self.pending = 0
+
+	# Take in the answers from the worker, without waiting for them
+	def poll(self):
+		while self.pending and self.conn.poll():
+			serial, table = self.conn.recv()
+			self.pending -= 1
+			if serial == self.serial: self.table.update( table)
+
+	# The next move for the board as it is now.  Returns (found, move),
+	# where move is an Engine event or None.  When the move is not known
+	# yet a search is started from the given recording of the level (a
+	# Replay); steps is the number of frames the board is advanced by
+	# every frame drawn.
+	def lookup(self, board, replay, steps):
+		if board is not self.board:
+			self.board = board
+			self.table = {}
+			self.serial += 1
+
+		self.poll()
+		key = board_key( board)
+		if key in self.table: return (1, self.table[key])
+
+		# Search again if the board did not follow the last plan
+		if not self.pending:
+			if self.conn is None:
+				self.conn, child = multiprocessing.Pipe()
+				process = multiprocessing.Process( target=worker,
+					args=(child,))
+				process.daemon = True
+				process.start()
+			recording = (replay.circuit, replay.level, replay.gamestart,
+				replay.score, replay.lives, replay.seed, replay.events)
+			lead = (search_time + 1) * frames_per_sec * steps
+			self.conn.send( (self.serial, recording, board.frame, lead))
+			self.pending += 1
+		return (0, None)
@@ -21,7 +21,8 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
 # Import Modules
-import os, pygame, random, time, math, re, sys, md5
+import os, pygame, random, time, math, re, sys, md5, copy, struct, cPickle
+import threading, bisect, csv, json
 from pygame.locals import *
 
 # Parse the command line
@@ -32,21 +33,51 @@ colorblind = 0
 sound_on = 1
 music_on = 1
 music_pending_song = 0
-for arg in sys.argv[1:]:
-	if arg == '-s':
-		screenshot = 1
-	elif arg == '-f':
-		fullscreen = 1
-	elif arg == '-cb':
-		colorblind = 1
-	elif arg == '-q':
-		sound_on = 0
-		music_on = 0
-	elif arg[0] == '-':
-		print "Usage: "+sys.argv[0]+" [-cb] [-f] [-s] [highscores-file]\n"
-		sys.exit(1)
-	else:
-		highscores_file = arg
+turbo = 0
+display_stats = 0
+startup_timing = 0
+record_replays = 0
+replay_file = None
+game_seed = None
+frame_overlay = 0
+trace_file = None
+frame_timer = None
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	while args:
+		arg = args.pop(0)
+		if arg == '-s':
+			screenshot = 1
+		elif arg == '-f':
+			fullscreen = 1
+		elif arg == '-cb':
+			colorblind = 1
+		elif arg == '-q':
+			sound_on = 0
+			music_on = 0
+		elif arg == '-t':
+			turbo = 1
+		elif arg == '-p':
+			display_stats = 1
+		elif arg == '-st':
+			startup_timing = 1
+		elif arg == '-r':
+			record_replays = 1
+		elif arg == '-replay' and args:
+			replay_file = args.pop(0)
+		elif arg == '-seed' and args:
+			game_seed = int(args.pop(0))
+		elif arg == '-ft':
+			frame_overlay = 1
+		elif arg == '-trace' and args:
+			trace_file = args.pop(0)
+		elif arg[0] == '-':
+			print "Usage: "+sys.argv[0]+" [-cb] [-f] [-s] [-t] [-p] [-st] [-r]" + \
+				" [-replay file] [-seed n] [-ft] [-trace file.csv|file.json]" + \
+				" [highscores-file]\n"
+			sys.exit(1)
+		else:
+			highscores_file = arg
 
 if colorblind:
 	cbext = '-cb.png'
@@ -80,6 +111,7 @@ default_board_timer = 30    # 30 seconds per wheel
 marble_speed = 2            # Marble speed in pixels/frame (must be 1, 2 or 4)
 trigger_time = 30           # 30 seconds
 replicator_delay = 35       # 35 frames
+turbo_steps = 20            # Frames simulated per frame drawn in turbo mode
 
 # Don't change these constants unless you
 # redo all of the levels
@@ -90,6 +122,7 @@ vert_tiles = 6
 # update the graphics files correspondingly.
 screen_width = 800
 screen_height = 600
+full_update_fraction = 0.6  # Update the whole screen above this dirty area
 marble_size = 28
 tile_size = 92
 wheel_margin = 4
@@ -112,6 +145,7 @@ for i in range(wheel_steps):
 
 # Direction references
 dirs = ((0,-1),(1,0),(0,1),(-1,0))
+marble_steps = [(marble_speed * dx, marble_speed * dy) for dx, dy in dirs]
 
 # More global variables
 board_width = horiz_tiles * tile_size
@@ -121,6 +155,9 @@ board_pos = (timer_width, info_height + marble_size)
 timer_height = board_height + marble_size
 music_loaded = 0
 
+# Compiled levelsets and the image atlas are kept here
+cache_dir = os.path.join(os.environ["HOME"], ".pathological_cache")
+
 # Levelset variables
 levelset = 'all-boards'
 levelsetFolder = 'circuits'
@@ -129,9 +166,55 @@ customsSetsFiles = ['all-boards']
 customsSetsFiles += [f for f in os.listdir('user_circuits') \
 	if os.path.isfile(os.path.join('user_circuits', f)) and '~' not in f]
 
+# Print a line of the startup timeline: the time since the program
+# started, and how long the step that began at start took.
+startup_begin = time.time()
+def log_startup(what, start):
+	if not startup_timing: return
+	now = time.time()
+	print "%8.3fs %8.1fms  %s" % (now - startup_begin, (now - start) * 1000, what)
+
 # Functions to create our resources
+
+# Images are decoded and scaled only once.  The converted images are kept
+# in image_cache for warm restarts, and the scaled pixels of every image
+# are saved to an atlas file in the cache directory, so that later runs
+# can skip decoding and scaling altogether.
+use_image_atlas = 1
+image_atlas_file = os.path.join(cache_dir, "images")
+image_cache = {}
+image_atlas = None
+image_atlas_changed = 0
+
 def load_image(name, colorkey=-1, size=None):
+	key = (name, colorkey, size)
+	if key in image_cache: return image_cache[key]
+
+	start = time.time()
+	image = load_scaled_image(name, size).convert()
+
+	if colorkey is not None:
+		if colorkey is -1:
+			colorkey = image.get_at((0,0))
+		image.set_colorkey(colorkey, RLEACCEL)
+	image_cache[key] = image
+	log_startup( '  image '+name, start)
+	return image
+
+def load_scaled_image(name, size):
+	global image_atlas, image_atlas_changed
 	fullname = os.path.join('graphics', name)
+	try:
+		mtime = os.path.getmtime(fullname)
+	except OSError:
+		mtime = None
+
+	if use_image_atlas:
+		if image_atlas is None: load_image_atlas()
+		entry = image_atlas.get((name, size))
+		if entry is not None and entry[0] == mtime:
+			return pygame.image.fromstring(entry[2], entry[1], 'RGB')
+
 	try:
 		image = pygame.image.load(fullname)
 	except pygame.error, message:
@@ -140,19 +223,44 @@ def load_image(name, colorkey=-1, size=None):
 
 	if size is not None:
 		image = pygame.transform.scale( image, size)
-	image = image.convert()
 
-	if colorkey is not None:
-		if colorkey is -1:
-			colorkey = image.get_at((0,0))
-		image.set_colorkey(colorkey, RLEACCEL)
+	if use_image_atlas:
+		image_atlas[(name, size)] = (mtime, image.get_size(),
+			pygame.image.tostring(image, 'RGB'))
+		image_atlas_changed = 1
 	return image
 
+def load_image_atlas():
+	global image_atlas
+	try:
+		f = open( image_atlas_file, 'rb')
+		image_atlas = cPickle.load( f)
+		f.close()
+	except:
+		image_atlas = {}
+
+def save_image_atlas():
+	global image_atlas_changed
+	if not use_image_atlas or not image_atlas_changed: return
+	try:
+		if not os.path.isdir( cache_dir):
+			os.makedirs( cache_dir)
+		tmpname = image_atlas_file + '.' + `os.getpid()`
+		f = open( tmpname, 'wb')
+		cPickle.dump( image_atlas, f, 2)
+		f.close()
+		os.rename( tmpname, image_atlas_file)
+		image_atlas_changed = 0
+	except (IOError, OSError), message:
+		print "Warning: Can't save image atlas:", message
+
+class NoneSound:
+	def play(self): pass
+
 def load_sound(name, volume=1.0):
-	class NoneSound:
-		def play(self): pass
 	if not pygame.mixer or not pygame.mixer.get_init():
 		return NoneSound()
+	start = time.time()
 	fullname = os.path.join('sounds', name)
 	try:
 		sound = pygame.mixer.Sound(fullname)
@@ -161,6 +269,7 @@ def load_sound(name, volume=1.0):
 		return NoneSound()
 
 	sound.set_volume( volume * sound_effects_volume)
+	log_startup( '  sound '+name, start)
 
 	return sound
 
@@ -206,6 +315,10 @@ def toggle_sound():
 	global sound_on
 	sound_on = sound_on ^ 1
 
+def toggle_turbo():
+	global turbo
+	turbo = turbo ^ 1
+
 def toggle_music():
 	global music_pending_song, music_on
 	music_on = music_on ^ 1
@@ -225,6 +338,12 @@ def setLevelset():
 	else: levelsetFolder = 'user_circuits'
 	IntroScreen.start_level = 1
 	
+# The number of levels in a levelset, counted the first time it is needed
+def getLevelNumber(levelsetToCheck):
+	if levelsetToCheck not in levelNumber:
+		levelNumber[levelsetToCheck] = countLevels(levelsetToCheck)
+	return levelNumber[levelsetToCheck]
+
 def countLevels(levelsetToCheck=None):
 	if not levelsetToCheck:
 		fullname = os.path.join(levelsetFolder, levelset)
@@ -232,20 +351,176 @@ def countLevels(levelsetToCheck=None):
 		if levelsetToCheck == 'all-boards': folder='circuits'
 		else: folder='user_circuits'
 		fullname = os.path.join(folder,levelsetToCheck)
-	
+
+	return len(load_levelset(fullname).levels)
+
+# A levelset file, compiled into one record per level.  Each record is
+# (settings, tiles): settings holds the raw value of each of the
+# level_settings lines (or None), and tiles holds three bytes per tile
+# in row order: the type character, the paths bitmask and the control
+# character.  Compiled levelsets are kept in cache_dir, one file per
+# levelset file, named after the MD5 of its path.  The file holds the
+# MD5 of the levelset text it was compiled from, so it is only rebuilt
+# when the text changes, and then replaced.
+level_settings = ('name','maxmarbles','launchtimer','boardtimer',
+	'colors','stoplight')
+compiled_levels_magic = 'PLC2'
+
+# Compile the text of a levelset into one record per level, as kept in
+# Levelset.levels
+def compile_levels(text):
+	levels = []
+	settings = [None] * len(level_settings)
+	tiles = []
+	for line in text.splitlines(1):
+		if line[0] != '|':
+			for i in range(len(level_settings)):
+				key = level_settings[i] + '='
+				if line[0:len(key)] == key:
+					settings[i] = line[len(key):-1]
+			continue
+
+		line = line.rstrip('\r\n').ljust( horiz_tiles*4 + 1)
+		for i in range(horiz_tiles):
+			paths = line[i*4+2]
+			if paths >= 'a' and paths <= 'f': pathsint = ord(paths)-ord('a')+10
+			elif paths >= '0' and paths <= '9': pathsint = int(paths)
+			else: pathsint = 0
+			tiles.append( line[i*4+1] + chr(pathsint) + line[i*4+3])
+
+		if len(tiles) == horiz_tiles * vert_tiles:
+			levels.append( (tuple(settings), ''.join(tiles)))
+			settings = [None] * len(level_settings)
+			tiles = []
+	return levels
+
+class Levelset:
+	def __init__(self, fullname):
+		f = open( fullname)
+		text = f.read()
+		f.close()
+
+		self.cachename = os.path.join( cache_dir,
+			md5.new(os.path.abspath( fullname)).hexdigest())
+		self.digest = md5.new(text).digest()
+		try:
+			self.levels = self._read_compiled()
+		except:
+			self.levels = compile_levels( text)
+			self._write_compiled()
+
+	def _read_compiled(self):
+		f = open( self.cachename, 'rb')
+		data = f.read()
+		f.close()
+
+		magic, numlevels, digest = struct.unpack_from( '<4sI16s', data)
+		if magic != compiled_levels_magic or digest != self.digest:
+			raise ValueError, self.cachename
+		pos = 24
+		levels = []
+		for j in range(numlevels):
+			settings = []
+			for i in range(len(level_settings)):
+				size = struct.unpack_from( '<H', data, pos)[0]
+				pos += 2
+				if size == 0xffff:
+					settings.append( None)
+				else:
+					settings.append( data[pos:pos+size])
+					pos += size
+			size = horiz_tiles * vert_tiles * 3
+			if pos + size > len(data): raise ValueError, self.cachename
+			levels.append( (tuple(settings), data[pos:pos+size]))
+			pos += size
+		return levels
+
+	def _write_compiled(self):
+		data = [struct.pack( '<4sI16s', compiled_levels_magic,
+			len(self.levels), self.digest)]
+		for settings, tiles in self.levels:
+			for value in settings:
+				if value is None: data.append( struct.pack( '<H', 0xffff))
+				else: data.append( struct.pack( '<H', len(value)) + value)
+			data.append( tiles)
+
+		# Write to a temporary file first, so that a partly written
+		# file is never picked up by another copy of the game
+		try:
+			if not os.path.isdir( cache_dir):
+				os.makedirs( cache_dir)
+			tmpname = self.cachename + '.' + `os.getpid()`
+			f = open( tmpname, 'wb')
+			f.write( ''.join(data))
+			f.close()
+			if sys.platform[0:3] == 'win' and os.path.exists( self.cachename):
+				os.remove( self.cachename)
+			os.rename( tmpname, self.cachename)
+			remove_old_compiled()
+		except (IOError, OSError), message:
+			print "Warning: Can't save compiled levels:", message
+
+# Remove the compiled levelsets left by older versions, which were named
+# after the levelset text and so never replaced
+def remove_old_compiled():
+	for name in os.listdir( cache_dir):
+		path = os.path.join( cache_dir, name)
+		if len(name) != 32 or not os.path.isfile( path): continue
+		f = open( path, 'rb')
+		magic = f.read( 4)
+		f.close()
+		if magic == 'PLC1': os.remove( path)
+
+# A level that can't be played as it is written; the message tells
+# where it went wrong
+class LevelError(ValueError):
+	def __init__(self, where, problem):
+		ValueError.__init__(self, where + ": " + problem)
+		self.problem = problem
+
+# The line of a levelset file that holds the given row of a level,
+# counting from 1
+def level_line(fullname, level, row):
+	rows = level * vert_tiles + row + 1
+	line = 0
 	f = open( fullname)
-	j=0
-	while 1:
-		line = f.readline()
-		if line == '': break
-		if line[0] == '|': j += 1
+	for text in f:
+		line += 1
+		if text[0] == '|':
+			rows -= 1
+			if rows == 0: break
 	f.close()
-	
-	numlevels = j / vert_tiles
-
-	return numlevels
+	return line
+
+# Parsed levelsets, with the modification time of the file they came from
+levelset_cache = {}
+
+def load_levelset(fullname):
+	mtime = os.path.getmtime( fullname)
+	if fullname in levelset_cache:
+		cached = levelset_cache[fullname]
+		if cached[0] == mtime: return cached[1]
+	levels = Levelset( fullname)
+	levelset_cache[fullname] = (mtime, levels)
+	return levels
+
+# The levelset files named on the command line of the tools;
+# directories stand for the levelsets in them
+def levelset_files(names):
+	files = []
+	for name in names:
+		if os.path.isdir( name):
+			for entry in sorted( os.listdir( name)):
+				path = os.path.join( name, entry)
+				if entry[0] != '.' and os.path.isfile( path):
+					files.append( path)
+		else:
+			files.append( name)
+	return files
 
-# A better tick function
+# A better tick function.
+# Returns the milliseconds actually slept, and how many milliseconds
+# late the frame already was if there was no time to wait.
 next_frame = pygame.time.get_ticks()
 def my_tick( frames_per_sec):
 	global next_frame
@@ -255,9 +530,18 @@ def my_tick( frames_per_sec):
 	if next_frame < now:
 		# No time to wait - just hide our mistake
 		# and keep going as fast as we can.
+		behind = now - next_frame
 		next_frame = now
+		return (0, behind)
 	else:
-		pygame.time.wait( int(next_frame) - now)
+		return (pygame.time.wait( int(next_frame) - now), 0)
+
+# Until load_sounds has run, every sound effect is silent
+filter_admit = wheel_turn = wheel_completed = change_color = \
+	direct_marble = ping = trigger_setup = teleport = marble_release = \
+	levelfinish = die = incorrect = switch = shredder = replicator = \
+	extra_life = menu_scroll = menu_select = NoneSound()
+sounds_loader = None
 
 # Load the sounds
 def load_sounds():
@@ -285,13 +569,30 @@ def load_sounds():
 	menu_scroll = load_sound('menu_scroll.wav', 0.8)
 	menu_select = load_sound('switch.wav')
 
+# Load the sounds on a background thread, so that the intro screen
+# does not have to wait for them.  They only need to be loaded once.
+def start_loading_sounds():
+	global sounds_loader
+	if sounds_loader is not None: return
+
+	def run():
+		start = time.time()
+		load_sounds()
+		log_startup( 'load_sounds (background)', start)
+
+	sounds_loader = threading.Thread( target=run)
+	sounds_loader.setDaemon( 1)
+	sounds_loader.start()
+
 # Load the fonts for various parts of the game
 def load_fonts():
 	global launch_timer_font,active_marbles_font,popup_font,info_font
+	global overlay_font
 
 	launch_timer_font = pygame.font.Font(None, timer_width - 2*timer_margin)
 	active_marbles_font = pygame.font.Font(None, marble_size)
 	popup_font = pygame.font.Font(None, 24)
+	overlay_font = pygame.font.Font(None, 18)
 	info_font = pygame.font.Font(None, info_height)
 
 # Load all of the images for the various game classes.
@@ -305,13 +606,12 @@ def load_images():
 	Tile.plain_tiles = []
 	Tile.tunnels = []
 	for i in range(16):
-		tile = load_image('tile.png', (206,53,53), (tile_size,tile_size))
+		tile = load_image('tile.png', (206,53,53), (tile_size,tile_size)).copy()
 		path = load_image('path-'+`i`+'.png', -1, (tile_size,tile_size))
 		tile.blit( path, (0,0))
 		Tile.plain_tiles.append( tile)
 		Tile.tunnels.append(load_image('tunnel-'+`i`+'.png',
 			-1,(tile_size,tile_size)))
-	Tile.paths = 0
 
 	Wheel.images = (
 		load_image('wheel.png',-1,(tile_size,tile_size)),
@@ -380,6 +680,11 @@ def load_images():
 	Board.launcher_entrance = load_image('entrance.png', -1,
 		(tile_size,marble_size))
 
+	Board.backdrop = load_image('backdrop.jpg', None,
+		(horiz_tiles * tile_size, vert_tiles * tile_size))
+	Game.backdrop = load_image('backdrop.jpg', None,
+		(screen_width, screen_height))
+
 	IntroScreen.background = load_image('intro.png', None,
 		(screen_width, screen_height))
 	IntroScreen.menu_font = pygame.font.Font(
@@ -389,6 +694,54 @@ def load_images():
 	IntroScreen.hs_font = pygame.font.Font(
 		None, IntroScreen.hs_font_height)
 
+# Rendered text, keyed by font, text and color, so that
+# unchanged text is not rendered again on every frame
+text_cache = {}
+text_cache_size = 200
+
+def render_text(font, text, color):
+	key = (font, text, color)
+	if key not in text_cache:
+		if len(text_cache) >= text_cache_size: text_cache.clear()
+		text_cache[key] = font.render( text, 1, color)
+	return text_cache[key]
+
+# Copy a rectangle of the background back onto the screen.
+# Only the pixels in the rectangle are read from the background.
+def restore_background(surface, background, rect):
+	surface.blit( background, rect, rect)
+
+# Merge overlapping and touching rectangles, so that each pixel on
+# the screen is sent to pygame.display.update only once
+def merge_rects(rects):
+	merged = []
+	for rect in rects:
+		rect = pygame.Rect(rect)
+		while 1:
+			i = rect.inflate(2,2).collidelist( merged)
+			if i < 0: break
+			rect.union_ip( merged.pop(i))
+		merged.append( rect)
+	return merged
+
+# Push the dirty rectangles to the display, falling back to a single
+# full update when they cover most of the screen anyway.
+# Returns the number of pixels that were pushed.
+def update_display(rects):
+	screen_rect = pygame.Rect(0, 0, screen_width, screen_height)
+	rects = merge_rects( rects)
+	pixels = 0
+	for rect in rects:
+		rect = rect.clip( screen_rect)
+		pixels += rect.width * rect.height
+
+	if pixels > full_update_fraction * screen_width * screen_height:
+		pygame.display.update()
+		return screen_width * screen_height
+
+	pygame.display.update( rects)
+	return pixels
+
 # Function to set the video mode
 def set_video_mode():
 	global screen
@@ -401,31 +754,76 @@ def set_video_mode():
 	pygame.display.set_icon(icon) # Needed both before and after set_mode
 	pygame.display.set_caption('Pathological')
 
+# Tile kinds.  Every tile class has one as its kind, so that tiles can
+# be told apart with a comparison instead of isinstance.
+kind_tile, kind_wheel, kind_buffer, kind_painter, kind_filter, \
+	kind_director, kind_shredder, kind_switch, kind_replicator, \
+	kind_teleporter, kind_trigger, kind_stoplight = range(12)
+
+# The kind of tile for each type character in a level
+tile_kinds = {
+	' ':kind_tile, 'O':kind_wheel, '@':kind_buffer, '&':kind_painter,
+	'#':kind_filter, '^':kind_director, '>':kind_director,
+	'v':kind_director, '<':kind_director, 'X':kind_shredder,
+	'*':kind_replicator, '=':kind_teleporter, '%':kind_trigger,
+	'!':kind_stoplight }
+for c in '012345678': tile_kinds[c] = kind_tile
+direction_chars = '^>v<'
+
+# The kinds of tile that change by themselves, and must be updated
+# every frame
+animated_kinds = (kind_wheel, kind_replicator, kind_trigger)
+
 # Classes for our game objects
 
-class Marble:
+# Marbles and tiles have slots instead of a __dict__, as a board holds
+# many of them and the solver copies boards by the thousand.  A marble
+# only keeps the screen position of its center; its Rect is made when
+# it is drawn.
+class Marble(object):
+	__slots__ = ('color', 'x', 'y', 'direction')
+
 	def __init__(self, color, center, direction):
 		self.color = color
-		self.rect = pygame.Rect((0,0,marble_size,marble_size))
-		self.rect.center = center
+		self.x = int(center[0])
+		self.y = int(center[1])
 		self.direction = direction
 
+	def get_rect(self):
+		return pygame.Rect( self.x - marble_size/2, self.y - marble_size/2,
+			marble_size, marble_size)
+	rect = property( get_rect)
+
+	# Copying a marble directly is much faster than copy's generic
+	# handling of slots
+	def __deepcopy__(self, memo):
+		return Marble( self.color, (self.x, self.y), self.direction)
+
 	def update(self, board):
-		self.rect.move_ip(
-			marble_speed * dirs[self.direction][0],
-			marble_speed * dirs[self.direction][1])
+		step = marble_steps[self.direction]
+		self.x += step[0]
+		self.y += step[1]
 
 		board.affect_marble( self)
 
 	def undraw(self, screen, background):
-		screen.set_clip( self.rect)
-		screen.blit( background, (0,0))
-		screen.set_clip()
+		restore_background( screen, background, self.rect)
 
 	def draw(self, screen):
-		screen.blit( self.images[self.color], self.rect.topleft)
+		screen.blit( self.images[self.color],
+			(self.x - marble_size/2, self.y - marble_size/2))
+
+# The slots copied by Tile.__deepcopy__, by class
+copied_slots = {}
+
+class Tile(object):
+	__slots__ = ('paths', 'center', 'rect', 'drawn', 'x', 'y')
+	kind = kind_tile
+
+	# The tile-relative marble coordinates at which affect_marble may
+	# act on a marble reaching them.  Used by Engine.quiet_frames.
+	marble_stops = (tile_size/2,)
 
-class Tile:
 	def __init__(self, paths=0, center=None):
 		self.paths = paths
 
@@ -437,6 +835,28 @@ class Tile:
 		self.rect.center = center
 		self.drawn = 0
 
+	# Copy the slots of the tile and all of its base classes.  A tile
+	# never moves once placed, so its rect and center are shared.
+	def __deepcopy__(self, memo):
+		cls = self.__class__
+		tile = object.__new__( cls)
+		memo[id(self)] = tile
+
+		names = copied_slots.get( cls)
+		if names is None:
+			names = []
+			for base in cls.__mro__:
+				for name in base.__dict__.get( '__slots__', ()):
+					if name != 'rect' and name != 'center': names.append( name)
+			copied_slots[cls] = names
+
+		for name in names:
+			if hasattr( self, name):
+				setattr( tile, name, copy.deepcopy( getattr( self, name), memo))
+		tile.rect = self.rect
+		tile.center = self.center
+		return tile
+
 	def draw_back(self, surface):
 		if self.drawn: return 0
 		surface.blit( self.plain_tiles[self.paths], self.rect.topleft)
@@ -447,7 +867,7 @@ class Tile:
 
 	def draw_fore(self, surface): return 0
 
-	def click(self, board, posx, posy, tile_x, tile_y): pass
+	def click(self, board, posx, posy, tile_x, tile_y, button): pass
 
 	def affect_marble(self, board, marble, rpos):
 		if rpos == (tile_size/2,tile_size/2):
@@ -462,6 +882,11 @@ class Tile:
 			else: marble.direction = marble.direction ^ 2
 
 class Wheel(Tile):
+	__slots__ = ('spinpos', 'completed', 'marbles')
+	kind = kind_wheel
+	marble_stops = tuple([int(c) for hole in holecenters[0] for c in hole]) + \
+		(wheel_margin - marble_size/2, tile_size - wheel_margin + marble_size/2)
+
 	def __init__(self, paths, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 		self.spinpos = 0
@@ -498,12 +923,14 @@ class Wheel(Tile):
 			self.spinpos -= 1
 			self.drawn = 0
 
-	def click(self, board, posx, posy, tile_x, tile_y):
+			# The wheel may complete once it stops
+			if self.spinpos == 0: board.dirty_wheels.add( self)
+
+	def click(self, board, posx, posy, tile_x, tile_y, button):
 		# Ignore all clicks while rotating
 		if self.spinpos: return
 
-		b1, b2, b3 = pygame.mouse.get_pressed()
-		if b3:
+		if button == 3:
 			# First, make sure that no marbles are currently entering
 			for i in self.marbles:
 				if i == -1 or i == -2: return
@@ -521,7 +948,7 @@ class Wheel(Tile):
 
 			self.drawn = 0
 
-		elif b1:
+		elif button == 1:
 			# Determine which hole is being clicked
 			for i in range(4):
 				# If there is no marble here, skip it
@@ -546,14 +973,14 @@ class Wheel(Tile):
 						# If the neighbor is a wheel that is either turning
 						# or has a marble already in the hole, disallow
 						# the ejection
-						(isinstance(neighbor, Wheel) and
+						(neighbor.kind == kind_wheel and
 						(neighbor.spinpos or
 						neighbor.marbles[i^2] != -3))
 						):
 						play_sound( incorrect)
 					else:
 						# If the neighbor is a wheel, apply a special lock
-						if isinstance(neighbor, Wheel):
+						if neighbor.kind == kind_wheel:
 							neighbor.marbles[i^2] = -2
 						elif len(board.marbles) >= board.live_marbles_limit:
 							# Impose the live marbles limit
@@ -590,6 +1017,7 @@ class Wheel(Tile):
 				# Accept the marble
 				board.marbles.remove( marble)
 				self.marbles[marble.direction^2] = marble.color
+				board.dirty_wheels.add( self)
 
 				self.drawn = 0
 
@@ -599,7 +1027,9 @@ class Wheel(Tile):
 		# Complete the wheel
 		for i in range(4): self.marbles[i] = -3
 		if self.completed: board.game.increase_score( 10)
-		else: board.game.increase_score( 50)
+		else:
+			board.game.increase_score( 50)
+			board.wheels_completed += 1
 		self.completed = 1
 		play_sound( wheel_completed)
 		self.drawn = 0
@@ -640,6 +1070,11 @@ class Wheel(Tile):
 		return 1
 
 class Buffer(Tile):
+	__slots__ = ('marble', 'entering')
+	kind = kind_buffer
+	marble_stops = (tile_size/2 - marble_size, tile_size/2,
+		tile_size/2 + marble_size)
+
 	def __init__(self, paths, color=-1):
 		Tile.__init__(self, paths) # Call base class intializer
 		self.marble = color
@@ -677,7 +1112,7 @@ class Buffer(Tile):
 			if self.entering is not None:
 				# Bump the marble that is currently entering
 				newmarble = self.entering
-				newmarble.rect.center = self.rect.center
+				newmarble.x, newmarble.y = self.rect.center
 				newmarble.direction = marble.direction
 
 				play_sound( ping)
@@ -711,6 +1146,9 @@ class Buffer(Tile):
 			self.drawn = 0
 
 class Painter(Tile):
+	__slots__ = ('color',)
+	kind = kind_painter
+
 	def __init__(self, paths, color, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 		self.color = color
@@ -729,6 +1167,9 @@ class Painter(Tile):
 				play_sound( change_color)
 
 class Filter(Tile):
+	__slots__ = ('color',)
+	kind = kind_filter
+
 	def __init__(self, paths, color, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 		self.color = color
@@ -749,6 +1190,9 @@ class Filter(Tile):
 				play_sound( filter_admit)
 
 class Director(Tile):
+	__slots__ = ('direction',)
+	kind = kind_director
+
 	def __init__(self, paths, direction, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 		self.direction = direction
@@ -764,6 +1208,9 @@ class Director(Tile):
 			play_sound( direct_marble)
 
 class Shredder(Tile):
+	__slots__ = ()
+	kind = kind_shredder
+
 	def __init__(self, paths, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 
@@ -778,6 +1225,9 @@ class Shredder(Tile):
 			play_sound( shredder)
 
 class Switch(Tile):
+	__slots__ = ('curdir', 'otherdir', 'switched')
+	kind = kind_switch
+
 	def __init__(self, paths, dir1, dir2, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 		self.curdir = dir1
@@ -805,6 +1255,9 @@ class Switch(Tile):
 			self.switch()
 
 class Replicator(Tile):
+	__slots__ = ('count', 'pending')
+	kind = kind_replicator
+
 	def __init__(self, paths, count, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
 		self.count = count
@@ -843,15 +1296,18 @@ class Replicator(Tile):
 			play_sound( replicator)
 
 class Teleporter(Tile):
+	__slots__ = ('other',)
+	kind = kind_teleporter
+
 	def __init__(self, paths, other=None, center=None):
 		Tile.__init__(self, paths, center) # Call base class intializer
-		if paths & 5: self.image = self.image_v
-		else: self.image = self.image_h
+		self.other = None
 		if other is not None: self.connect( other)
 
 	def draw_fore(self, surface):
 		surface.blit( self.tunnels[self.paths], self.rect.topleft)
-		surface.blit( self.image, self.rect.topleft)
+		if self.paths & 5: surface.blit( self.image_v, self.rect.topleft)
+		else: surface.blit( self.image_h, self.rect.topleft)
 		return 0
 
 	def connect(self, other):
@@ -859,23 +1315,29 @@ class Teleporter(Tile):
 		other.other = self
 
 	def affect_marble(self, board, marble, rpos):
-		if rpos == (tile_size/2, tile_size/2):
-			marble.rect.center = self.other.rect.center
+		# Without a partner, it is a plain track
+		if self.other is None:
+			Tile.affect_marble( self, board, marble, rpos)
+		elif rpos == (tile_size/2, tile_size/2):
+			marble.x, marble.y = self.other.rect.center
 			play_sound( teleport)
 
 class Trigger(Tile):
-	def __init__(self, colors, center=None):
+	__slots__ = ('countdown', 'marbles')
+	kind = kind_trigger
+
+	def __init__(self, colors, rng, center=None):
 		Tile.__init__(self, 0, center) # Call base class intializer
 		self.marbles = None
-		self._setup( colors)
+		self._setup( colors, rng)
 
-	def _setup(self, colors):
+	def _setup(self, colors, rng):
 		self.countdown = 0
 		self.marbles = [
-			random.choice(colors),
-			random.choice(colors),
-			random.choice(colors),
-			random.choice(colors),
+			rng.choice(colors),
+			rng.choice(colors),
+			rng.choice(colors),
+			rng.choice(colors),
 			]
 		self.drawn = 0
 
@@ -883,7 +1345,8 @@ class Trigger(Tile):
 		if self.countdown > 0:
 			self.countdown -= 1
 			if self.countdown == 0:
-				self._setup( board.colors)
+				self._setup( board.colors, board.random)
+				board.dirty_wheels.update( board.wheels)
 				play_sound( trigger_setup)
 
 	def draw_back(self, surface):
@@ -901,9 +1364,13 @@ class Trigger(Tile):
 		self.marbles = None
 		self.countdown = trigger_time * frames_per_sec
 		self.drawn = 0
+		board.dirty_wheels.update( board.wheels)
 		board.game.increase_score( 50)
 
 class Stoplight(Tile):
+	__slots__ = ('current', 'marbles')
+	kind = kind_stoplight
+
 	def __init__(self, colors, center=None):
 		Tile.__init__(self, 0, center) # Call base class intializer
 		self.marbles = list(colors)
@@ -926,16 +1393,184 @@ class Stoplight(Tile):
 				break
 		self.current += 1
 		self.drawn = 0
+		board.dirty_wheels.update( board.wheels)
 		board.game.increase_score( 20)
 
-class Board:
-	def __init__(self, game, pos):
+# The seed of a level's board, derived from the game seed.  It is the
+# same on every platform, so a seed given on the command line always
+# deals the same marbles.
+def level_seed(seed, level):
+	hash = md5.new(`seed`+"/"+`level`).digest()
+	return struct.unpack( '<I', hash[:4])[0] & 0x3fffffff
+
+# Where marbles can go on a board, worked out from the level alone.
+# It is made from the tiles of a compiled level (see Levelset), so that
+# the editor and the tools can use it without building an Engine.
+#
+# The nodes of the graph are (tile_x, tile_y, direction) for a marble
+# entering a tile, travelling in that direction, (tile_x, tile_y,
+# 4 + hole) for a marble held in a wheel hole, and (tile_x, tile_y,
+# 8 + direction) for a marble setting off from the center of a tile,
+# as teleported marbles and the marbles on the board at first do.
+# Every way a tile may send
+# a marble on is an edge: a filter may pass or bounce it, a switch may
+# point either way, a wheel may take it or turn it back, and a marble in
+# a wheel can be turned to any hole and ejected where there is a path.
+# Leaving the board wraps around, as it does for Wheel.click, except
+# that marbles going off the top bounce back down.
+#
+# Reachability is worked out once, so that "can a marble ever get here"
+# is a set lookup:
+#   from_launcher - The nodes reached from the launcher entrances
+#   from_wheels[(x,y)] - The nodes reached from the holes of a wheel
+#   from_marbles - The nodes reached from each marble on the board at first
+#   reachable - The nodes reached from the launcher or the marbles
+#   unreachable_wheels - The (x,y) of the wheels no marble can get into
+#   dead_ends - The reachable nodes from which no wheel can be reached,
+#     such as loops that keep a marble forever
+class PathGraph:
+	def __init__(self, tiles):
+		# The kind, paths and directions of each tile, by (x,y), and
+		# where each teleporter sends marbles, paired as Engine._load does
+		self.tiles = {}
+		self.other = {}
+		teleporters = {}
+		starts = []
+		for j in range(vert_tiles):
+			for i in range(horiz_tiles):
+				k = (j * horiz_tiles + i) * 3
+				type, paths, control = tiles[k], ord(tiles[k+1]), tiles[k+2]
+				kind = tile_kinds.get( type, kind_tile)
+				turns = ()
+				if kind == kind_director:
+					turns = tuple([direction_chars.index(c) for c in
+						type + control if c in direction_chars])
+				elif kind == kind_teleporter:
+					if control in teleporters:
+						first = teleporters[control]
+						self.other[(i, j)] = first
+						self.other[first] = (i, j)
+					else:
+						teleporters[control] = (i, j)
+				elif type >= '0' and type <= '8':
+					# Marbles without a direction roll left
+					direction = 3
+					if control in direction_chars:
+						direction = direction_chars.index(control)
+					starts.append( (i, j, 8 + direction))
+				self.tiles[(i, j)] = (kind, paths, turns)
+
+		self.edges = {}
+		for (x, y), (kind, paths, turns) in self.tiles.items():
+			for direction in range(4):
+				self.edges[(x, y, direction)] = self._enter( x, y, direction)
+				self.edges[(x, y, 8 + direction)] = \
+					(self._leave( x, y, direction),)
+			if kind == kind_wheel:
+				for hole in range(4):
+					self.edges[(x, y, 4 + hole)] = self._hold( x, y, hole)
+
+		entrances = [(i, 0, 2) for i in range(horiz_tiles)
+			if self.tiles[(i, 0)][1] & 1]
+		self.from_launcher = self.reach( entrances)
+
+		self.from_wheels = {}
+		for (x, y), (kind, paths, turns) in self.tiles.items():
+			if kind == kind_wheel:
+				self.from_wheels[(x, y)] = self.reach( [(x, y, 4)])
+
+		self.from_marbles = [self.reach( [start]) for start in starts]
+
+		self.reachable = set(self.from_launcher)
+		for nodes in self.from_marbles: self.reachable.update( nodes)
+		self.reachable_tiles = set([node[:2] for node in self.reachable])
+
+		self.unreachable_wheels = [wheel for wheel in self.from_wheels
+			if (wheel[0], wheel[1], 4) not in self.reachable]
+		self.unreachable_wheels.sort()
+
+		# Work back from the wheel holes to find the nodes that lead to one
+		leads = {}
+		for node, nexts in self.edges.items():
+			for after in nexts: leads.setdefault( after, []).append( node)
+		holes = [node for node in self.edges if 4 <= node[2] < 8]
+		useful = self.reach( holes, leads)
+		self.dead_ends = self.reachable - useful
+
+	# The node a marble leaving the given tile in the given direction
+	# gets to
+	def _leave(self, x, y, direction):
+		if y == 0 and direction == 0: return (x, 0, 2)
+		return ((x + dirs[direction][0]) % horiz_tiles,
+			(y + dirs[direction][1]) % vert_tiles, direction)
+
+	# Where a marble entering a tile may go, as Tile.affect_marble and
+	# the affect_marble of each kind of tile would send it
+	def _enter(self, x, y, direction):
+		kind, paths, turns = self.tiles[(x, y)]
+		if kind == kind_wheel:
+			return ((x, y, 4 + (direction ^ 2)),
+				self._leave( x, y, direction ^ 2))
+		if kind == kind_shredder: return ()
+		if kind == kind_teleporter and (x, y) in self.other:
+			other = self.other[(x, y)]
+			return ((other[0], other[1], 8 + direction),)
+		if kind != kind_director:
+			turns = (self._turn( paths, direction),)
+			if kind == kind_filter and turns[0] != direction ^ 2:
+				turns += (direction ^ 2,)
+		return tuple([self._leave( x, y, turn) for turn in turns])
+
+	# A marble in a wheel can be turned to any hole, or ejected
+	def _hold(self, x, y, hole):
+		nexts = [(x, y, 4 + i) for i in range(4) if i != hole]
+		if self.tiles[(x, y)][1] & (1 << hole) and not (y == 0 and hole == 0):
+			nexts.append( self._leave( x, y, hole))
+		return tuple(nexts)
+
+	# The direction Tile.affect_marble sends a marble on in
+	def _turn(self, paths, direction):
+		if paths & (1 << direction): return direction
+		t = paths - (1 << (direction ^ 2))
+		if t == 1: return 0
+		elif t == 2: return 1
+		elif t == 4: return 2
+		elif t == 8: return 3
+		return direction ^ 2
+
+	# The set of nodes reached from the given ones
+	def reach(self, nodes, edges=None):
+		if edges is None: edges = self.edges
+		reached = set(nodes)
+		pending = list(nodes)
+		while pending:
+			for after in edges.get( pending.pop(), ()):
+				if after not in reached:
+					reached.add( after)
+					pending.append( after)
+		return reached
+
+	# Whether a marble can ever get into the given tile
+	def can_reach(self, x, y):
+		return (x, y) in self.reachable_tiles
+
+# The marble physics of a single board, with no display or mixer needed.
+# An Engine is driven one frame at a time by step(), which accepts an
+# explicit list of input events:
+#   ('click', x, y, button) - A mouse click at screen position (x,y)
+#   ('rotate', tile_x, tile_y) - Rotate the wheel at the given tile
+#   ('eject', tile_x, tile_y, hole) - Eject the marble in a wheel hole
+class Engine:
+	def __init__(self, game, pos=board_pos, seed=None):
 		self.game = game
 		self.pos = pos
 		self.marbles = []
-		self.screen = game.screen
 		self.trigger = None
 		self.stoplight = None
+		self.wheels = []
+		self.animated_tiles = []
+		self.dirty_wheels = set()
+		self.wheels_completed = 0
 		self.launch_queue = []
 		self.board_complete = 0
 		self.paused = 0
@@ -945,6 +1580,17 @@ class Board:
 		self.board_timeout = -1
 		self.colors = default_colors
 		self.launched = 1
+		self.frame = 0
+		self.timer = None
+		self.stops = None
+		self.level_tiles = None
+		self.graph = None
+
+		# Each board draws from its own random numbers, so that boards
+		# can run side by side and a level can be replayed exactly
+		if seed is None: seed = level_seed( game.seed, game.level)
+		self.seed = seed
+		self.random = random.Random( seed)
 
 		self.set_launch_timer( default_launch_timer)
 		self.set_board_timer( default_board_timer)
@@ -969,196 +1615,49 @@ class Board:
 				(ord(hash[2]) << 16) + (ord(hash[3]) << 24)) & 32767;
 			self._load( game.circuit, hashval % game.numlevels);
 
-		# Create the launch timer text object
-		self.launch_timer_text = launch_timer_font.render(
-			`self.launch_timer`, 1, (255,255,255))
-		self.launch_timer_text_rect = self.launch_timer_text.get_rect()
-		self.launch_timer_text_rect.centerx = launch_timer_pos[0]+timer_width/2+1
-		self.launch_timer_text_rect.bottom = \
-			launch_timer_pos[1] + timer_height - timer_margin
-
 		# Fill up the launch queue
 		for i in range( vert_tiles * tile_size / marble_size + 2):
-			self.launch_queue.append(random.choice(self.colors))
-
-		# Create The Background
-		self.background = pygame.Surface(screen.get_size()).convert()
-		self.background.fill((200, 200, 200)) # Color of Info Bar
-
-		# Draw the Backdrop
-		backdrop = load_image('backdrop.jpg', None,
-			(horiz_tiles * tile_size, vert_tiles * tile_size))
-		self.background.blit( backdrop, board_pos);
-
-		# Draw the launcher
-		self.background.blit( self.launcher_background,
-			(board_pos[0], board_pos[1] - marble_size))
-		self.background.blit( self.launcher_v,
-			(board_pos[0]+horiz_tiles*tile_size, board_pos[1]))
-		for i in range( horiz_tiles):
-			if self.tiles[0][i].paths & 1:
-				self.background.blit( self.launcher_entrance, 
-					(board_pos[0]+tile_size*i, board_pos[1]-marble_size))
-		self.background.blit( self.launcher_corner,
-			(board_pos[0]+horiz_tiles*tile_size-(tile_size-marble_size)/2,
-			board_pos[1] - marble_size))
-
-		# Draw the board name
-		board_name = `self.game.level+1` + " - " + self.name
-		if self.game.level >= self.game.numlevels:
-			board_name += " (Random)"
-		text = info_font.render( board_name, 1, (0,0,0))
-		rect = text.get_rect()
-		rect.left = 8
-		self.background.blit( text, rect)
-
-		# Figure out the score location
-		text = "Score: 00000000"
-		self.score_pos = screen_width - 8 - \
-			info_font.render( text, 1, (0,0,0)).get_rect().width
-
-		# Figure out the board timer location
-		text = "00:00"
-		self.board_timer_pos = self.score_pos - 16 - \
-			info_font.render( text, 1, (0,0,0)).get_rect().width
-
-		# Initialize the screen
-		screen.blit(self.background, (0, 0))
-
-	def draw_back(self, dirty_rects):
-		# Draw the launch timer
-		if self.launch_timer_height is None:
-			height = timer_height
-			rect = (launch_timer_pos[0],launch_timer_pos[1],
-				timer_width,timer_height)
-			self.screen.fill((0,0,0), rect)
-			self.screen.fill((0,40,255),
-				(launch_timer_pos[0]+timer_margin,
-				launch_timer_pos[1]+timer_height-height,
-				timer_width-timer_margin*2,height))
-			dirty_rects.append( rect)
-		else:
-			height = timer_height*self.launch_timeout/self.launch_timeout_start
-			if height < self.launch_timer_height:
-				rect = (launch_timer_pos[0] + timer_margin,
-					launch_timer_pos[1] + timer_height - self.launch_timer_height,
-					timer_width-2*timer_margin, self.launch_timer_height - height)
-				self.screen.fill((0,0,0), rect)
-				dirty_rects.append( rect)
-		self.launch_timer_height = height
-		self.screen.blit( self.launch_timer_text, self.launch_timer_text_rect)
-		dirty_rects.append( self.launch_timer_text_rect)
+			self.launch_queue.append(self.random.choice(self.colors))
 
-		# Clear the info bar
-		rect = (0,0,screen_width,info_height)
-		self.screen.set_clip( rect)
-		self.screen.blit( self.background, (0,0))
-		self.screen.set_clip()
-		dirty_rects.append( rect)
+	def step(self, events=()):
+		# Apply the input events for this frame
+		for event in events:
+			self.handle_event( event)
 
-		# Draw the score
-		text = "Score: "+("00000000"+`self.game.score`)[-8:]
-		text = info_font.render( text, 1, (0,0,0))
-		rect = text.get_rect()
-		rect.left = self.score_pos
-		self.screen.blit( text, rect)
-
-		# Draw the board timer
-		time_remaining = (self.board_timeout+frames_per_sec-1)/frames_per_sec
-		text = `time_remaining/60`+":"+("00"+`time_remaining%60`)[-2:]
-		text = info_font.render( text, 1, (0,0,0))
-		rect = text.get_rect()
-		rect.left = self.board_timer_pos
-		self.screen.blit( text, rect)
-
-		# Draw the lives counter
-		right_edge = self.board_timer_pos - 32
-		for i in range(self.game.lives - 1):
-			rect = self.life_marble.get_rect()
-			rect.centery = info_height / 2
-			rect.right = right_edge
-			self.screen.blit( self.life_marble, rect)
-			right_edge -= rect.width + 4
-
-		# Draw the live marbles
-		num_marbles = len(self.marbles)
-		if num_marbles > self.live_marbles_limit:
-			num_marbles = self.live_marbles_limit
-		text = `num_marbles`+"/"+`self.live_marbles_limit`
-		text = active_marbles_font.render( text, 1, (40,40,40))
-		rect = text.get_rect()
-		rect.left = self.pos[0] + 8
-		rect.centery = self.pos[1] - marble_size / 2
-		rect.width += 100
-		self.screen.set_clip( rect)
-		self.screen.blit( self.background, (0,0))
-		self.screen.set_clip()
-		self.screen.blit( text, rect)
-
-		dirty_rects.append( rect)
-
-		for row in self.tiles:
-			for tile in row:
-				if tile.draw_back( self.background):
-					self.screen.set_clip( tile.rect)
-					self.screen.blit( self.background, (0,0))
-					self.screen.set_clip()
-					dirty_rects.append( tile.rect)
-
-		if self.launched:
-			for i in range(len(self.launch_queue)):
-				self.background.blit( Marble.images[self.launch_queue[i]],
-					(self.pos[0] + horiz_tiles * tile_size,
-					self.pos[1] + i * marble_size - marble_size))
-			rect = (self.pos[0] + horiz_tiles * tile_size,
-					self.pos[1] - marble_size, marble_size,
-					marble_size + tile_size * vert_tiles)
-			self.screen.set_clip( rect)
-			self.screen.blit( self.background, (0,0))
-			self.screen.set_clip()
-			dirty_rects.append( rect)
-			self.launched = 0
-
-	def draw_fore(self, dirty_rects):
-		for row in self.tiles:
-			for tile in row:
-				if tile.draw_fore(self.screen):
-					dirty_rects.append( tile.rect)
-
-	def update(self):
-		# Create the list of dirty rectangles
-		dirty_rects = []
-
-		# Erase the marbles
-		for marble in self.marbles:
-			marble.undraw( self.screen, self.background)
-			dirty_rects.append( list(marble.rect))
+		self.frame += 1
 
 		# Animate the marbles
 		for marble in self.marbles[:]:
 			marble.update( self)
+		if self.timer is not None: self.timer.lap( 'marbles')
 
-		# Animate the tiles
-		for row in self.tiles:
-			for tile in row:
-				tile.update( self)
-				if tile.drawn == 0: dirty_rects.append( tile.rect)
+		self.end_step()
 
-		# Complete any wheels, if appropriate
-		try_again = 1
-		while try_again:
-			try_again = 0
-			for row in self.tiles:
-				for tile in row:
-					if isinstance( tile, Wheel):
-						try_again |= tile.maybe_complete( self)
+	# The rest of a frame, once the marbles have moved
+	def end_step(self):
+		timer = self.timer
+
+		# Animate the tiles
+		for tile in self.animated_tiles:
+			tile.update( self)
+		if timer is not None: timer.lap( 'tiles')
+
+		# Complete any wheels, if appropriate.  Only the wheels that have
+		# taken a marble or stopped turning since they were last checked
+		# can complete; a trigger or stoplight change marks them all.
+		# They are checked in board order, as completing one can
+		# change what the others must match.
+		while self.dirty_wheels:
+			for wheel in self.wheels:
+				if wheel in self.dirty_wheels:
+					self.dirty_wheels.remove( wheel)
+					wheel.maybe_complete( self)
 
 		# Check if the board is complete
-		self.board_complete = 1
-		for row in self.tiles:
-			for tile in row:
-				if isinstance( tile, Wheel):
-					if tile.completed == 0: self.board_complete = 0
+		self.board_complete = 0
+		if self.wheels_completed == len(self.wheels): self.board_complete = 1
+
+		if timer is not None: timer.lap( 'wheels')
 
 		# Decrement the launch timer
 		if self.launch_timeout > 0:
@@ -1170,19 +1669,171 @@ class Board:
 			self.board_timeout -= 1
 			if self.board_timeout == 0: self.board_complete = -2
 
-		# Draw the background
-		self.draw_back( dirty_rects)
+	def handle_event(self, event):
+		if event[0] == 'click':
+			self.click( (event[1], event[2]), event[3])
+		elif event[0] == 'rotate':
+			tile = self.tiles[event[2]][event[1]]
+			tile.click( self, tile_size/2, tile_size/2,
+				event[1], event[2], 3)
+		elif event[0] == 'eject':
+			tile = self.tiles[event[2]][event[1]]
+			holecenter = holecenters[0][event[3]]
+			tile.click( self, holecenter[0], holecenter[1],
+				event[1], event[2], 1)
+
+	# Mirror Board.play_level: one frame, then the first launch
+	def start(self, events=()):
+		self.step( events)
+		self.launch_marble()
+
+	# The number of frames from now in which nothing would happen but
+	# marbles rolling between stops and timers counting down
+	def quiet_frames(self):
+		if self.dirty_wheels: return 0
+
+		quiet = sys.maxint
+		if self.launch_timeout > 0: quiet = self.launch_timeout - 1
+		if self.board_timeout > 0:
+			quiet = min( quiet, self.board_timeout - 1)
+
+		for tile in self.animated_tiles:
+			if tile.kind == kind_wheel:
+				if tile.spinpos: return 0
+			elif tile.kind == kind_replicator:
+				for i in tile.pending: quiet = min( quiet, i[3] - 1)
+			elif tile.countdown > 0:
+				quiet = min( quiet, tile.countdown - 1)
 
-		# Draw all of the marbles
 		for marble in self.marbles:
-			marble.draw( self.screen)
-			dirty_rects.append( marble.rect)
+			cx = marble.x - self.pos[0]
+			cy = marble.y - self.pos[1]
+			step = marble_steps[marble.direction]
+			if step[0]:
+				# Marbles rolling along the top may bounce off of it
+				if cy == marble_size/2: return 0
+				c, line, speed = cx, cy / tile_size, step[0]
+			else:
+				c, line, speed = cy, cx / tile_size, step[1]
 
-		# Draw the foreground
-		self.draw_fore( dirty_rects)
+			frames = self._stop_distance(
+				self.stops[(marble.direction, line)], c, speed)
+			quiet = min( quiet, frames - 1)
+			if quiet <= 0: return 0
 
-		# Flip the display
-		pygame.display.update( dirty_rects)
+		return quiet
+
+	# The number of frames before a marble at c moving by speed reaches
+	# one of the given stops; sys.maxint if it never does
+	def _stop_distance(self, stops, c, speed):
+		if speed > 0:
+			for stop in stops[bisect.bisect_right( stops, c):]:
+				if (stop - c) % speed == 0: return (stop - c) / speed
+		else:
+			for stop in stops[bisect.bisect_left( stops, c)-1::-1]:
+				if (stop - c) % speed == 0: return (stop - c) / speed
+		return sys.maxint
+
+	# Jump over quiet frames, as counted by quiet_frames
+	def skip(self, frames):
+		for marble in self.marbles:
+			step = marble_steps[marble.direction]
+			marble.x += step[0] * frames
+			marble.y += step[1] * frames
+
+		for tile in self.animated_tiles:
+			if tile.kind == kind_replicator:
+				for i in tile.pending: i[3] -= frames
+			elif tile.kind == kind_trigger and tile.countdown > 0:
+				tile.countdown -= frames
+
+		if self.launch_timeout > 0: self.launch_timeout -= frames
+		if self.board_timeout > 0: self.board_timeout -= frames
+		self.frame += frames
+
+	# Play the given number of frames without input, or until the
+	# board is complete.  Quiet frames are skipped, which gives the
+	# same results as stepping through them much faster.
+	def advance(self, frames):
+		end = self.frame + frames
+		while self.frame < end and not self.board_complete:
+			quiet = min( self.quiet_frames(), end - self.frame - 1)
+			if quiet > 0: self.skip( quiet)
+			self.step()
+
+	# Play the level without a display.  The events are a list of
+	# (frame, event) pairs; each event is applied just before the
+	# given frame is simulated.  Returns the same values as
+	# Board.play_level, or 0 if max_frames was reached first.
+	# Unless skip is false, quiet frames between events are skipped.
+	def run(self, events=(), max_frames=None, skip=1):
+		schedule = {}
+		for frame, event in events:
+			schedule.setdefault( frame, []).append( event)
+		frames = schedule.keys()
+		frames.sort()
+
+		self.start( schedule.get( self.frame + 1, ()))
+
+		while not self.board_complete:
+			if max_frames is not None and self.frame >= max_frames: break
+			if not skip or self.frame + 1 in schedule:
+				self.step( schedule.get( self.frame + 1, ()))
+				continue
+
+			# Play up to the next frame with input
+			end = max_frames
+			i = bisect.bisect_right( frames, self.frame)
+			if i < len(frames) and (end is None or frames[i] - 1 < end):
+				end = frames[i] - 1
+			if end is None: end = sys.maxint
+			self.advance( end - self.frame)
+
+		return self.board_complete
+
+	# Return an independent copy of the simulation state
+	def clone(self):
+		# The stops and path graph never change, so they are shared;
+		# the random numbers are copied by state, which is much faster
+		rng = random.Random( 0)
+		rng.setstate( self.random.getstate())
+		return copy.deepcopy( self, {id(self.stops): self.stops,
+			id(self.graph): self.graph, id(self.random): rng})
+
+	# The path graph of the level, made the first time it is needed
+	def path_graph(self):
+		if self.graph is None: self.graph = PathGraph( self.level_tiles)
+		return self.graph
+
+	# Find where each tile can act on a marble passing through it.
+	# Builds stops[(direction, line)], the sorted board-relative
+	# coordinates along each row (or column) at which a marble travelling
+	# through it in that direction may be acted upon.  The launcher is
+	# row -1.  See affect_marble.
+	def find_stops(self):
+		self.stops = {}
+		for direction in range(4):
+			dx, dy = dirs[direction]
+			for line in range( dx and vert_tiles or horiz_tiles):
+				stops = []
+				if direction == 0: stops.append( marble_size/2)
+				for i in range( dx and horiz_tiles or vert_tiles):
+					if dx: tile = self.tiles[line][i]
+					else: tile = self.tiles[i][line]
+					for stop in tile.marble_stops:
+						# Which tile acts depends on the leading edge
+						if 0 <= stop + (dx+dy) * marble_size/2 < tile_size:
+							stops.append( i * tile_size + stop)
+				stops.sort()
+				self.stops[(direction, line)] = stops
+
+		for direction in (1, 3):
+			stops = [marble_size/2]
+			for i in range( horiz_tiles):
+				if self.tiles[0][i].paths & 1:
+					stops.append( i * tile_size + tile_size/2)
+			if direction == 1: stops.append( board_width - marble_size/2)
+			self.stops[(direction, -1)] = stops
 
 	def set_tile(self, x, y, tile):
 		self.tiles[y][x] = tile
@@ -1192,12 +1843,19 @@ class Board:
 		tile.x = x
 		tile.y = y
 
+		# Keep track of the tiles to update, and the wheels, in board order
+		if tile.kind in animated_kinds:
+			self.animated_tiles.append( tile)
+		if tile.kind == kind_wheel:
+			self.wheels.append( tile)
+			self.dirty_wheels.add( tile)
+
 		# If it's a trigger, keep track of it
-		if isinstance( tile, Trigger):
+		elif tile.kind == kind_trigger:
 			self.trigger = tile
 
 		# If it's a stoplight, keep track of it
-		if isinstance( tile, Stoplight):
+		elif tile.kind == kind_stoplight:
 			self.stoplight = tile
 
 	def set_launch_timer(self, passes):
@@ -1212,7 +1870,7 @@ class Board:
 		self.board_timeout = self.board_timeout_start
 
 	def launch_marble(self):
-		self.launch_queue.append(random.choice(self.colors))
+		self.launch_queue.append(self.random.choice(self.colors))
 		self.marbles.insert( 0, Marble( self.launch_queue[0],
 			(self.pos[0]+tile_size*horiz_tiles+marble_size/2,
 			self.pos[1]-marble_size/2), 3))
@@ -1223,9 +1881,8 @@ class Board:
 		self.launch_timer_height = None
 
 	def affect_marble(self, marble):
-		c = marble.rect.center
-		cx = c[0] - self.pos[0]
-		cy = c[1] - self.pos[1]
+		cx = marble.x - self.pos[0]
+		cy = marble.y - self.pos[1]
 
 		# Bounce marbles off of the top
 		if cy == marble_size/2:
@@ -1260,7 +1917,7 @@ class Board:
 		if cy < 0 and marble.direction != 2:
 			# The special case of new marbles at the top
 			if tile_xr == tile_size / 2 and (tile.paths & 1):
-				if isinstance( tile, Wheel):
+				if tile.kind == kind_wheel:
 					if tile.spinpos > 0 or tile.marbles[0] != -3: return
 					tile.marbles[0] = -2
 					marble.direction = 2
@@ -1271,7 +1928,7 @@ class Board:
 		else:
 			tile.affect_marble( self, marble, (tile_xr, tile_yr))
 
-	def click(self, pos):
+	def click(self, pos, button):
 		# Determine which tile the pointer is in
 		tile_x = (pos[0] - self.pos[0]) / tile_size
 		tile_y = (pos[1] - self.pos[1]) / tile_size
@@ -1280,131 +1937,433 @@ class Board:
 		if tile_x >= 0 and tile_x < horiz_tiles and \
 			tile_y >= 0 and tile_y < vert_tiles:
 			tile = self.tiles[tile_y][tile_x]
-			tile.click( self, tile_xr, tile_yr, tile_x, tile_y)
+			tile.click( self, tile_xr, tile_yr, tile_x, tile_y, button)
 
 	def _load(self, circuit, level):
 		fullname = os.path.join(circuit[0], circuit[1])
-		f = open( fullname)
-
-		# Skip the previous levels
-		j = 0
-		while j < vert_tiles * level:
-			line = f.readline()
-			if line == '':
-				f.close()
-				return 0
-			if line[0] == '|': j += 1
+		levels = load_levelset( fullname).levels
+		if level >= len(levels): return 0
 
 		teleporters = []
 		teleporter_names = []
 		stoplight = default_stoplight
 
-		numwheels = 0
 		boardtimer = -1
 
-		j = 0
-		while j < vert_tiles:
-			line = f.readline()
-
-			if line[0] != '|':
-				if line[0:5] == 'name=':
-					self.name = line[5:-1]
-				elif line[0:11] == 'maxmarbles=':
-					self.live_marbles_limit = int(line[11:-1])
-				elif line[0:12] == 'launchtimer=':
-					self.set_launch_timer( int(line[12:-1]))
-				elif line[0:11] == 'boardtimer=':
-					boardtimer = int(line[11:-1])
-				elif line[0:7] == 'colors=':
-					self.colors = []
-					for c in line[7:-1]:
-						if c >= '0' and c <= '7':
-							self.colors.append(int(c))
-							self.colors.append(int(c))
-							self.colors.append(int(c))
-						elif c == '8':
-							# Crazy marbles are one-third as common
-							self.colors.append(8)
-				elif line[0:10] == 'stoplight=':
-					stoplight = []
-					for c in line[10:-1]:
-						if c >= '0' and c <= '7':
-							stoplight.append(int(c))
-
-				continue
-
+		name, maxmarbles, launchtimer, boardtimer_text, colors, \
+			stoplight_text = levels[level][0]
+		if name is not None:
+			self.name = name
+		if maxmarbles is not None:
+			self.live_marbles_limit = int(maxmarbles)
+		if launchtimer is not None:
+			self.set_launch_timer( int(launchtimer))
+		if boardtimer_text is not None:
+			boardtimer = int(boardtimer_text)
+		if colors is not None:
+			self.colors = []
+			for c in colors:
+				if c >= '0' and c <= '7':
+					self.colors.append(int(c))
+					self.colors.append(int(c))
+					self.colors.append(int(c))
+				elif c == '8':
+					# Crazy marbles are one-third as common
+					self.colors.append(8)
+		if stoplight_text is not None:
+			stoplight = []
+			for c in stoplight_text:
+				if c >= '0' and c <= '7':
+					stoplight.append(int(c))
+
+		def where():
+			return "%s:%d:%d: level %d" % (fullname,
+				level_line( fullname, level, j), i*4 + 4, level + 1)
+		def bad_level(message):
+			raise LevelError( where(), message)
+
+		# How to make a tile of each kind, from the type, paths and
+		# color of the tile being loaded
+		def make_buffer():
+			if color == ' ': return Buffer(pathsint)
+			return Buffer(pathsint, colorint)
+		def make_director():
+			direction = direction_chars.index(type)
+			if color == ' ': return Director(pathsint, direction)
+			if color not in direction_chars:
+				bad_level( "a switch needs a direction (^, >, v or <), not " +
+					`color`)
+			if color == type:
+				print "Warning: " + where() + ": a switch needs two" + \
+					" different directions, not " + `type + color`
+			return Switch(pathsint, direction, direction_chars.index(color))
+		def make_teleporter():
+			if color in teleporter_names:
+				other = teleporters[teleporter_names.index(color)]
+				return Teleporter( pathsint, other)
+			tile = Teleporter( pathsint)
+			teleporters.append( tile)
+			teleporter_names.append( color)
+			return tile
+		makers = {
+			kind_tile: lambda: Tile(pathsint),
+			kind_wheel: lambda: Wheel(pathsint),
+			kind_buffer: make_buffer,
+			kind_painter: lambda: Painter(pathsint, colorint),
+			kind_filter: lambda: Filter(pathsint, colorint),
+			kind_director: make_director,
+			kind_shredder: lambda: Shredder(pathsint),
+			kind_replicator: lambda: Replicator(pathsint, colorint),
+			kind_teleporter: make_teleporter,
+			kind_trigger: lambda: Trigger(self.colors, self.random),
+			kind_stoplight: lambda: Stoplight(stoplight),
+			}
+
+		tiles = levels[level][1]
+		for j in range(vert_tiles):
 			for i in range(horiz_tiles):
-				type = line[i*4+1]
-				paths = line[i*4+2]
-				if paths == ' ': pathsint = 0
-				elif paths >= 'a': pathsint = ord(paths)-ord('a')+10
-				elif paths >= '0' and paths <= '9': pathsint = int(paths)
-				else: pathsint = int(paths)
-				color = line[i*4+3]
+				k = (j * horiz_tiles + i) * 3
+				type = tiles[k]
+				pathsint = ord(tiles[k+1])
+				color = tiles[k+2]
 				if color == ' ': colorint = 0
 				elif color >= 'a': colorint = ord(color)-ord('a')+10
 				elif color >= '0' and color <= '9': colorint = int(color)
 				else: colorint = 0
 
-				if type == 'O':
-					tile = Wheel( pathsint)
-					numwheels += 1
-				elif type == '%': tile = Trigger(self.colors)
-				elif type == '!': tile = Stoplight(stoplight)
-				elif type == '&': tile = Painter(pathsint, colorint)
-				elif type == '#': tile = Filter(pathsint, colorint)
-				elif type == '@':
-					if color == ' ': tile = Buffer(pathsint)
-					else: tile = Buffer(pathsint, colorint)
-				elif type == ' ' or \
-					(type >= '0' and type <= '8'): tile = Tile(pathsint)
-				elif type == 'X': tile = Shredder(pathsint)
-				elif type == '*': tile = Replicator(pathsint, colorint)
-				elif type == '^':
-					if color == ' ': tile = Director(pathsint, 0)
-					elif color == '>': tile = Switch(pathsint, 0, 1)
-					elif color == 'v': tile = Switch(pathsint, 0, 2)
-					elif color == '<': tile = Switch(pathsint, 0, 3)
-				elif type == '>':
-					if color == ' ': tile = Director(pathsint, 1)
-					elif color == '^': tile = Switch(pathsint, 1, 0)
-					elif color == 'v': tile = Switch(pathsint, 1, 2)
-					elif color == '<': tile = Switch(pathsint, 1, 3)
-				elif type == 'v':
-					if color == ' ': tile = Director(pathsint, 2)
-					elif color == '^': tile = Switch(pathsint, 2, 0)
-					elif color == '>': tile = Switch(pathsint, 2, 1)
-					elif color == '<': tile = Switch(pathsint, 2, 3)
-				elif type == '<':
-					if color == ' ': tile = Director(pathsint, 3)
-					elif color == '^': tile = Switch(pathsint, 3, 0)
-					elif color == '>': tile = Switch(pathsint, 3, 1)
-					elif color == 'v': tile = Switch(pathsint, 3, 2)
-				elif type == '=':
-					if color in teleporter_names:
-						other = teleporters[teleporter_names.index(color)]
-						tile = Teleporter( pathsint, other)
-					else:
-						tile = Teleporter( pathsint)
-						teleporters.append( tile)
-						teleporter_names.append( color)
+				# Unknown types are left as plain tracks
+				tile = makers[tile_kinds.get(type, kind_tile)]()
 
 				self.set_tile( i, j, tile)
 
 				if type >= '0' and type <= '8':
-					if color == '^': direction = 0
-					elif color == '>': direction = 1
-					elif color == 'v': direction = 2
-					else: direction = 3
-					self.marbles.append(
-						Marble(int(type),tile.rect.center,direction))
-
-			j += 1
-		if boardtimer < 0: boardtimer = default_board_timer * numwheels
+					# A marble without a direction rolls left, as it
+					# always has
+					if color in direction_chars:
+						direction = direction_chars.index(color)
+					else:
+						print "Warning: " + where() + ": a marble needs a" + \
+							" direction (^, >, v or <), not " + `color` + \
+							"; it rolls left"
+						direction = 3
+					self.marbles.append( Marble(int(type),tile.rect.center,
+						direction))
+
+		if boardtimer < 0: boardtimer = default_board_timer * len(self.wheels)
 		self.set_board_timer( boardtimer)
-		f.close()
+		self.find_stops()
+		self.level_tiles = tiles
 		return 1
 
+# Finds the hints asked for with the 'h' key; see hints.py
+hinter = None
+hint_time = 3   # Seconds a hint is shown for
+
+class Board(Engine):
+	def __init__(self, game, pos, seed=None):
+		Engine.__init__(self, game, pos, seed)
+		self.screen = game.screen
+		self.pixels_updated = 0
+		self.pixels_total = 0
+		self.frames_drawn = 0
+		self.info_shown = None
+		self.num_marbles_shown = None
+		self.num_marbles_rect = pygame.Rect(0,0,0,0)
+		self.timer = frame_timer
+		self.overlay = None
+		self.overlay_rect = None
+		self.hint_asked = 0
+		self.hint_frames = 0
+		self.hint = None
+		self.hint_rect = None
+
+		# Create the launch timer text object
+		self.launch_timer_text = launch_timer_font.render(
+			`self.launch_timer`, 1, (255,255,255))
+		self.launch_timer_text_rect = self.launch_timer_text.get_rect()
+		self.launch_timer_text_rect.centerx = launch_timer_pos[0]+timer_width/2+1
+		self.launch_timer_text_rect.bottom = \
+			launch_timer_pos[1] + timer_height - timer_margin
+
+		# Create The Background
+		self.background = pygame.Surface(screen.get_size()).convert()
+		self.background.fill((200, 200, 200)) # Color of Info Bar
+
+		# Draw the Backdrop
+		self.background.blit( self.backdrop, board_pos);
+
+		# Draw the launcher
+		self.background.blit( self.launcher_background,
+			(board_pos[0], board_pos[1] - marble_size))
+		self.background.blit( self.launcher_v,
+			(board_pos[0]+horiz_tiles*tile_size, board_pos[1]))
+		for i in range( horiz_tiles):
+			if self.tiles[0][i].paths & 1:
+				self.background.blit( self.launcher_entrance, 
+					(board_pos[0]+tile_size*i, board_pos[1]-marble_size))
+		self.background.blit( self.launcher_corner,
+			(board_pos[0]+horiz_tiles*tile_size-(tile_size-marble_size)/2,
+			board_pos[1] - marble_size))
+
+		# Draw the board name
+		board_name = `self.game.level+1` + " - " + self.name
+		if self.game.level >= self.game.numlevels:
+			board_name += " (Random)"
+		text = info_font.render( board_name, 1, (0,0,0))
+		rect = text.get_rect()
+		rect.left = 8
+		self.background.blit( text, rect)
+
+		# Figure out the score location
+		text = "Score: 00000000"
+		self.score_pos = screen_width - 8 - \
+			info_font.render( text, 1, (0,0,0)).get_rect().width
+
+		# Figure out the board timer location
+		text = "00:00"
+		self.board_timer_pos = self.score_pos - 16 - \
+			info_font.render( text, 1, (0,0,0)).get_rect().width
+
+		# Initialize the screen
+		screen.blit(self.background, (0, 0))
+
+	def draw_back(self, dirty_rects):
+		# Draw the launch timer
+		if self.launch_timer_height is None:
+			height = timer_height
+			rect = (launch_timer_pos[0],launch_timer_pos[1],
+				timer_width,timer_height)
+			self.screen.fill((0,0,0), rect)
+			self.screen.fill((0,40,255),
+				(launch_timer_pos[0]+timer_margin,
+				launch_timer_pos[1]+timer_height-height,
+				timer_width-timer_margin*2,height))
+			dirty_rects.append( rect)
+		else:
+			height = timer_height*self.launch_timeout/self.launch_timeout_start
+			if height < self.launch_timer_height:
+				rect = (launch_timer_pos[0] + timer_margin,
+					launch_timer_pos[1] + timer_height - self.launch_timer_height,
+					timer_width-2*timer_margin, self.launch_timer_height - height)
+				self.screen.fill((0,0,0), rect)
+				dirty_rects.append( rect)
+		self.launch_timer_height = height
+		self.screen.blit( self.launch_timer_text, self.launch_timer_text_rect)
+		dirty_rects.append( self.launch_timer_text_rect)
+
+		# Redraw the info bar, if anything on it has changed
+		time_remaining = (self.board_timeout+frames_per_sec-1)/frames_per_sec
+		info = (self.game.score, time_remaining, self.game.lives)
+		if info != self.info_shown:
+			self.info_shown = info
+
+			# Clear the info bar
+			rect = (0,0,screen_width,info_height)
+			restore_background( self.screen, self.background, rect)
+			dirty_rects.append( rect)
+
+			# Draw the score
+			text = "Score: "+("00000000"+`self.game.score`)[-8:]
+			text = render_text( info_font, text, (0,0,0))
+			rect = text.get_rect()
+			rect.left = self.score_pos
+			self.screen.blit( text, rect)
+
+			# Draw the board timer
+			text = `time_remaining/60`+":"+("00"+`time_remaining%60`)[-2:]
+			text = render_text( info_font, text, (0,0,0))
+			rect = text.get_rect()
+			rect.left = self.board_timer_pos
+			self.screen.blit( text, rect)
+
+			# Draw the lives counter
+			right_edge = self.board_timer_pos - 32
+			for i in range(self.game.lives - 1):
+				rect = self.life_marble.get_rect()
+				rect.centery = info_height / 2
+				rect.right = right_edge
+				self.screen.blit( self.life_marble, rect)
+				right_edge -= rect.width + 4
+
+		# Draw the live marbles, if their number has changed
+		num_marbles = len(self.marbles)
+		if num_marbles > self.live_marbles_limit:
+			num_marbles = self.live_marbles_limit
+		if num_marbles != self.num_marbles_shown:
+			self.num_marbles_shown = num_marbles
+			text = `num_marbles`+"/"+`self.live_marbles_limit`
+			text = render_text( active_marbles_font, text, (40,40,40))
+			rect = text.get_rect()
+			rect.left = self.pos[0] + 8
+			rect.centery = self.pos[1] - marble_size / 2
+			rect.width += 100
+			restore_background( self.screen, self.background, rect)
+			self.screen.blit( text, rect)
+			self.num_marbles_rect = rect
+
+			dirty_rects.append( rect)
+
+		for row in self.tiles:
+			for tile in row:
+				if tile.draw_back( self.background):
+					restore_background( self.screen, self.background, tile.rect)
+					dirty_rects.append( tile.rect)
+
+		if self.launched:
+			for i in range(len(self.launch_queue)):
+				self.background.blit( Marble.images[self.launch_queue[i]],
+					(self.pos[0] + horiz_tiles * tile_size,
+					self.pos[1] + i * marble_size - marble_size))
+			rect = (self.pos[0] + horiz_tiles * tile_size,
+					self.pos[1] - marble_size, marble_size,
+					marble_size + tile_size * vert_tiles)
+			restore_background( self.screen, self.background, rect)
+			dirty_rects.append( rect)
+			self.launched = 0
+
+	def draw_fore(self, dirty_rects):
+		for row in self.tiles:
+			for tile in row:
+				if tile.draw_fore(self.screen):
+					dirty_rects.append( tile.rect)
+
+	# Advance the simulation by the given number of frames,
+	# and then draw only the final one.
+	def update(self, steps=1):
+		timer = self.timer
+
+		# Create the list of dirty rectangles
+		dirty_rects = []
+
+		# Erase the frame time overlay
+		if self.overlay_rect is not None:
+			restore_background( self.screen, self.background,
+				self.overlay_rect)
+			dirty_rects.append( self.overlay_rect)
+			if self.overlay_rect.colliderect( self.num_marbles_rect):
+				self.num_marbles_shown = None
+
+		# Erase the hint
+		if self.hint_rect is not None:
+			restore_background( self.screen, self.background, self.hint_rect)
+			dirty_rects.append( self.hint_rect)
+			self.hint_rect = None
+
+		# Erase the marbles
+		for marble in self.marbles:
+			marble.undraw( self.screen, self.background)
+			rect = marble.rect
+			dirty_rects.append( rect)
+
+			# Erasing a marble also erases any live marbles text below it
+			if rect.colliderect( self.num_marbles_rect):
+				self.num_marbles_shown = None
+		if timer is not None: timer.lap( 'draw_marbles')
+
+		# Advance the simulation
+		for i in range(steps):
+			self.step()
+			if self.board_complete: break
+
+		# Redraw any tiles that have changed
+		for row in self.tiles:
+			for tile in row:
+				if tile.drawn == 0: dirty_rects.append( tile.rect)
+
+		# Draw the background
+		self.draw_back( dirty_rects)
+		if timer is not None: timer.lap( 'draw_back')
+
+		# Draw all of the marbles
+		for marble in self.marbles:
+			marble.draw( self.screen)
+			dirty_rects.append( marble.rect)
+		if timer is not None: timer.lap( 'draw_marbles')
+
+		# Draw the foreground
+		self.draw_fore( dirty_rects)
+		if timer is not None: timer.lap( 'draw_fore')
+
+		if self.hint_asked: self.draw_hint( dirty_rects)
+
+		# Draw the frame time overlay on top of everything
+		if frame_overlay and timer is not None:
+			self.draw_overlay( dirty_rects)
+			timer.lap( 'overlay')
+
+		# Flip the display
+		self.pixels_updated = update_display( dirty_rects)
+		if timer is not None: timer.lap( 'display')
+		self.pixels_total += self.pixels_updated
+		self.frames_drawn += 1
+
+	# Show the average frame times in the bottom left corner of the board.
+	# The text is only rendered again when the averages change.
+	def draw_overlay(self, dirty_rects):
+		lines = self.timer.overlay_lines()
+		if lines is not None or self.overlay is None:
+			if lines is None: lines = ["Measuring frame times..."]
+			objs = [overlay_font.render( line, 1, (255,255,255))
+				for line in lines]
+			width = max([obj.get_width() for obj in objs]) + 8
+			linesize = overlay_font.get_linesize()
+			self.overlay = pygame.Surface(
+				(width, linesize * len(objs) + 4)).convert()
+			for i in range(len(objs)):
+				self.overlay.blit( objs[i], (4, 2 + linesize * i))
+
+		self.overlay_rect = self.overlay.get_rect()
+		self.overlay_rect.bottomleft = (self.pos[0], self.pos[1] + board_height)
+		self.screen.blit( self.overlay, self.overlay_rect)
+		dirty_rects.append( self.overlay_rect)
+
+	def ask_hint(self):
+		global hinter
+		if hinter is None:
+			import hints
+			hinter = hints.HintEngine()
+		self.hint_asked = 1
+		self.hint_frames = 0
+
+	# Look for the hint asked for, until it is found, and then count
+	# down the frames it is shown for
+	def find_hint(self, recorder):
+		if self.hint_frames:
+			self.hint_frames -= 1
+			if not self.hint_frames: self.hint_asked = 0
+			return
+
+		steps = 1
+		if turbo: steps = turbo_steps
+		found, self.hint = hinter.lookup( self, recorder, steps)
+		if found: self.hint_frames = hint_time * frames_per_sec
+
+	# Circle the hole to eject or outline the wheel to rotate; until the
+	# hint is found, or if there is nothing to do, say so instead
+	def draw_hint(self, dirty_rects):
+		if self.hint_frames and self.hint is not None:
+			tile = self.tiles[self.hint[2]][self.hint[1]]
+			if self.hint[0] == 'rotate':
+				rect = pygame.draw.rect( self.screen, (255,255,255),
+					tile.rect.inflate( -4, -4), 3)
+			else:
+				holecenter = holecenters[0][self.hint[3]]
+				rect = pygame.draw.circle( self.screen, (255,255,255),
+					(tile.rect.left + int(holecenter[0]),
+					tile.rect.top + int(holecenter[1])), marble_size/2 + 3, 3)
+		else:
+			if self.hint_frames: text = "No move needed for now"
+			else: text = "Looking for a hint..."
+			text = render_text( overlay_font, text, (255,255,255))
+			rect = text.get_rect().inflate( 8, 4)
+			rect.bottomright = (self.pos[0] + horiz_tiles * tile_size,
+				self.pos[1] + board_height)
+			self.screen.fill( (0,0,0), rect)
+			self.screen.blit( text, (rect.left + 4, rect.top + 2))
+
+		self.hint_rect = rect
+		dirty_rects.append( rect)
+
 	# Return values for this function:
 	# -4: User closed the application window
 	# -3: User aborted the level
@@ -1413,7 +2372,18 @@ class Board:
 	#  1: Level completed successfully
 	#  2: User requested a skip to the next level
 	#  3: User requested a skip to the previous level
-	def play_level( self):
+	#
+	# If a replay is given, the recorded input is played back instead
+	# of the user's clicks.  If recorder is given, the user's input
+	# is added to it.
+	def play_level( self, replay=None, recorder=None):
+		if replay is not None:
+			schedule = replay.schedule( self.pos)
+
+		# Hints are searched from a recording of the level so far
+		elif recorder is None:
+			recorder = Replay( self.game, self)
+
 		# Perform the first render
 		self.update()
 
@@ -1428,20 +2398,36 @@ class Board:
 
 		# Game Loop
 		while not self.board_complete:
-			# Wait for the next frame
-			my_tick( frames_per_sec)
+			# Wait for the next frame, unless running at full speed
+			slept = behind = 0
+			if not turbo: slept, behind = my_tick( frames_per_sec)
+			if self.timer is not None:
+				self.timer.begin( self.name, self.frame + 1, slept, behind)
+
+			if self.hint_asked: self.find_hint( recorder)
+
+			# Play back the recorded input
+			if replay is not None and not self.paused:
+				if self.frame + 1 == replay.end_frame: return replay.end_rc
+				for event in schedule.get( self.frame + 1, ()):
+					self.handle_event( event)
 
 			# Handle Input Events
 			for event in pygame.event.get():
 				if event.type is QUIT:
-					return -4
+					return self.record_end( recorder, -4)
 				elif event.type is KEYDOWN:
-					if event.key is K_ESCAPE: return -3
-					elif event.key == ord('n'): return 2
-					elif event.key == ord('b'): return 3
+					if event.key is K_ESCAPE:
+						return self.record_end( recorder, -3)
+					elif event.key == ord('n'):
+						return self.record_end( recorder, 2)
+					elif event.key == ord('b'):
+						return self.record_end( recorder, 3)
 					elif event.key == ord(' ') or \
 						event.key == ord('p') or \
 						event.key == K_PAUSE:
+						if recorder is not None:
+							recorder.add( self.frame + 1, 'pause')
 						self.paused = self.paused ^ 1
 						if self.paused:
 							if screenshot:
@@ -1456,14 +2442,43 @@ class Board:
 						toggle_music()
 					elif event.key == K_F4:
 						toggle_sound()
+					elif event.key == ord('t'):
+						toggle_turbo()
+					elif event.key == ord('h') and replay is None:
+						self.ask_hint()
 
 				elif event.type is MOUSEBUTTONDOWN:
 					if self.paused:
+						if recorder is not None:
+							recorder.add( self.frame + 1, 'pause')
 						self.paused = 0
 						popdown( pause_popup)
-					else: self.click( pygame.mouse.get_pos())
-
-			if not self.paused: self.update()
+					elif replay is None:
+						if recorder is not None:
+							recorder.add_click( self.frame + 1, self.pos,
+								event.pos, event.button)
+						self.click( event.pos, event.button)
+						if self.hint_frames: self.hint_asked = 0
+
+			if self.timer is not None: self.timer.lap( 'events')
+
+			if not self.paused:
+				steps = 1
+				if turbo: steps = turbo_steps
+
+				# Stop a fast-forward at the next recorded event
+				if replay is not None:
+					steps = min( steps,
+						replay.next_frame( self.frame + 1) - self.frame - 1)
+				frame = self.frame
+				self.update( steps)
+				if self.timer is not None:
+					self.timer.end( self.frame - frame)
+
+		if display_stats and self.frames_drawn:
+			print "%s: %d frames drawn, %d pixels per frame on average" % \
+				(self.name, self.frames_drawn,
+				self.pixels_total / self.frames_drawn)
 
 		# Play the end sound
 		if self.board_complete > 0:
@@ -1471,7 +2486,222 @@ class Board:
 		else:
 			play_sound( die)
 
-		return self.board_complete
+		return self.record_end( recorder, self.board_complete)
+
+	def record_end(self, recorder, rc):
+		if recorder is not None: recorder.end( self.frame + 1, rc)
+		return rc
+
+# Times the parts of each frame drawn by Board.play_level, for the
+# frame time overlay (-ft) and the trace file (-trace).  All times are
+# in milliseconds.  slept is how long my_tick waited before the frame,
+# and behind is how late the frame already was when it could not wait.
+class FrameTimer:
+	phases = ('events', 'marbles', 'tiles', 'wheels', 'draw_back',
+		'draw_marbles', 'draw_fore', 'overlay', 'display')
+	columns = ('level', 'frame', 'steps', 'slept', 'behind') + phases + \
+		('total',)
+	overlay_frames = 25    # Frames averaged by the overlay
+
+	def __init__(self, keep_rows):
+		self.keep_rows = keep_rows
+		self.rows = []
+		self.recent = []
+		self.times = None
+
+	def begin(self, level, frame, slept, behind):
+		self.row = {'level':level, 'frame':frame, 'slept':slept,
+			'behind':behind}
+		self.times = dict.fromkeys( self.phases, 0.0)
+		self.start = self.last = time.time()
+
+	# Add the time since the last lap to the given phase
+	def lap(self, phase):
+		if self.times is None: return
+		now = time.time()
+		self.times[phase] += (now - self.last) * 1000
+		self.last = now
+
+	def end(self, steps):
+		if self.times is None: return
+		row = self.row
+		for phase in self.phases: row[phase] = round( self.times[phase], 3)
+		row['steps'] = steps
+		row['total'] = round( (self.last - self.start) * 1000, 3)
+		self.times = None
+
+		if self.keep_rows: self.rows.append( row)
+		self.recent.append( row)
+
+	# The text of the overlay, or None if it has not changed since the
+	# last call.  It changes every overlay_frames frames.
+	def overlay_lines(self):
+		if len(self.recent) < self.overlay_frames: return None
+		recent = self.recent
+		self.recent = []
+
+		average = {}
+		for key in self.phases + ('slept', 'total'):
+			average[key] = sum([row[key] for row in recent]) / len(recent)
+		late = [row for row in recent if row['behind'] > 0]
+		worst = max([row['total'] for row in recent])
+
+		return [
+			"frame %.2f ms (worst %.2f)  slept %.2f  behind %d/%d" %
+				(average['total'], worst, average['slept'],
+				len(late), len(recent)),
+			"events %.2f  marbles %.2f  tiles %.2f  wheels %.2f" %
+				(average['events'], average['marbles'],
+				average['tiles'], average['wheels']),
+			"back %.2f  marbles %.2f  fore %.2f  overlay %.2f  display %.2f" %
+				(average['draw_back'], average['draw_marbles'],
+				average['draw_fore'], average['overlay'],
+				average['display']),
+			]
+
+	# Write the rows to a file, as JSON if the name ends with .json
+	# and as CSV otherwise
+	def save(self, filename):
+		try:
+			f = open( filename, "wb")
+			if filename.endswith('.json'):
+				json.dump( self.rows, f, indent=1)
+			else:
+				writer = csv.DictWriter( f, self.columns)
+				writer.writerow( dict(zip(self.columns, self.columns)))
+				writer.writerows( self.rows)
+			f.close()
+		except IOError, message:
+			print "Warning: Can't save the frame trace:", message
+
+# A recording of the input for one level, which can be played back
+# on screen (Board.play_level) or headless (Replay.run).  The file is
+# a short header followed by one line per input event:
+#   <frame> click <tile_x> <tile_y> <x> <y> <button>
+#   <frame> pause
+#   <frame> end <return value of play_level>
+# Each event applies just before the given frame is simulated.
+class Replay:
+	def __init__(self, game=None, board=None):
+		self.events = []
+		self.end_frame = None
+		self.end_rc = 0
+		if game is not None:
+			self.circuit = game.circuit
+			self.level = game.level
+			self.gamestart = game.gamestart
+			self.score = game.score
+			self.lives = game.lives
+		if board is not None:
+			self.seed = board.seed
+
+	def add(self, frame, kind, *args):
+		self.events.append( (frame, kind) + args)
+
+	def add_click(self, frame, board_pos, pos, button):
+		x = pos[0] - board_pos[0]
+		y = pos[1] - board_pos[1]
+		if x < 0 or x >= horiz_tiles * tile_size or \
+			y < 0 or y >= vert_tiles * tile_size: return
+		self.add( frame, 'click', x / tile_size, y / tile_size,
+			x % tile_size, y % tile_size, button)
+
+	def end(self, frame, rc):
+		self.end_frame = frame
+		self.end_rc = rc
+
+	# The first frame after the given one with a recorded event;
+	# only valid after schedule() has been called
+	def next_frame(self, frame):
+		i = bisect.bisect_right( self.frames, frame)
+		if i < len(self.frames): return self.frames[i]
+		return frame + turbo_steps + 1
+
+	# The recorded clicks as Engine events, by frame
+	def schedule(self, board_pos):
+		self.frames = [event[0] for event in self.events]
+		if self.end_frame is not None: self.frames.append( self.end_frame)
+		self.frames.sort()
+
+		schedule = {}
+		for event in self.events:
+			if event[1] == 'click':
+				frame, kind, tile_x, tile_y, x, y, button = event
+				schedule.setdefault( frame, []).append( ('click',
+					board_pos[0] + tile_x * tile_size + x,
+					board_pos[1] + tile_y * tile_size + y, button))
+		return schedule
+
+	# Create a game in the state the recording started from
+	def make_game(self, screen=None, highscores=None):
+		game = Game( screen, self.circuit, highscores, self.level)
+		game.gamestart = self.gamestart
+		game.score = self.score
+		game.lives = self.lives
+		return game
+
+	# Play the recording back without a display, up to the given frame
+	# if any.  Returns the Engine and the return value of play_level.
+	def run(self, max_frames=None):
+		engine = Engine( self.make_game(), board_pos, self.seed)
+		events = []
+		for frame, events_now in self.schedule( board_pos).items():
+			for event in events_now: events.append( (frame, event))
+
+		if max_frames is not None:
+			rc = engine.run( events, max_frames)
+		elif self.end_frame is None:
+			rc = engine.run( events)
+		else:
+			rc = engine.run( events, self.end_frame - 1)
+			if not rc: rc = self.end_rc
+		return (engine, rc)
+
+	def save(self, filename):
+		f = open( filename, "w")
+		f.write( "pathological-replay 1\n")
+		f.write( "levelset "+self.circuit[0]+"/"+self.circuit[1]+"\n")
+		f.write( "level "+`self.level`+"\n")
+		f.write( "gamestart "+`self.gamestart`+"\n")
+		f.write( "seed "+`self.seed`+"\n")
+		f.write( "score "+`self.score`+"\n")
+		f.write( "lives "+`self.lives`+"\n")
+		for event in self.events:
+			f.write( ' '.join([str(i) for i in event])+"\n")
+		if self.end_frame is not None:
+			f.write( `self.end_frame`+" end "+`self.end_rc`+"\n")
+		f.close()
+
+	def load(self, filename):
+		f = open( filename)
+		if f.readline() != "pathological-replay 1\n":
+			f.close()
+			raise ValueError, filename + " is not a replay"
+		for line in f.readlines():
+			words = line.split()
+			if not words: continue
+			if words[0] == 'levelset':
+				self.circuit = os.path.split( line[9:-1])
+			elif words[0] == 'level': self.level = int(words[1])
+			elif words[0] == 'gamestart': self.gamestart = float(words[1])
+			elif words[0] == 'seed': self.seed = int(words[1])
+			elif words[0] == 'score': self.score = int(words[1])
+			elif words[0] == 'lives': self.lives = int(words[1])
+			elif words[1] == 'end':
+				self.end( int(words[0]), int(words[2]))
+			else:
+				self.add( int(words[0]), words[1], *[int(i) for i in words[2:]])
+		f.close()
+		return self
+
+# Where recorded replays are saved, with the -r option
+replay_dir = os.path.join(os.environ["HOME"], ".pathological_replays")
+
+def replay_filename(game):
+	if not os.path.isdir( replay_dir): os.makedirs( replay_dir)
+	return os.path.join( replay_dir, "%s-%s-%d.rpl" % (
+		time.strftime("%Y%m%d-%H%M%S"), game.circuit[1].replace(' ','-'),
+		game.level + 1))
 
 class HighScores:
 	num_highscores = 10
@@ -1603,11 +2833,11 @@ def popdown( popup_rc):
 		pygame.display.update( popup_rc[1])
 
 class Game:
-	def __init__(self, screen, circuit, highscores, level = 0):
+	def __init__(self, screen, circuit, highscores, level = 0, seed = None):
 		self.screen = screen
 		self.circuit = circuit
 		self.highscores = highscores
-		self.numlevels = levelNumber[levelset]
+		self.numlevels = len(load_levelset(os.path.join(*circuit)).levels)
 
 		self.level = level
 		self.score = 0
@@ -1615,6 +2845,10 @@ class Game:
 
 		self.gamestart = time.time()
 
+		# The seed of the whole game; each level's board is seeded from it
+		if seed is None: seed = random.randrange( 1 << 30)
+		self.seed = seed
+
 	def increase_score(self, amount):
 		# Add the amount to the score
 		self.score += amount
@@ -1627,6 +2861,32 @@ class Game:
 			self.lives += extra_lives
 			play_sound( extra_life)
 
+	# The bonus for completing a board.  Returns the percentage of time
+	# remaining and its bonus, and the percentage of holes empty and its
+	# bonus.
+	def level_bonus(self, board):
+		# Compute time remaining bonus; a board without a timer has all
+		# of its time left
+		if board.board_timeout_start > 0:
+			time_remaining = 100 * board.board_timeout / \
+				board.board_timeout_start
+		else:
+			time_remaining = 100
+		time_bonus = 5 * time_remaining
+
+		# Compute empty holes bonus
+		total_holes = 0
+		empty_holes = 0
+		for wheel in board.wheels:
+			total_holes += 4
+			for i in wheel.marbles:
+				if i < 0: empty_holes += 1
+		if total_holes:
+			empty_holes = (100 * empty_holes + total_holes/2) / total_holes
+		holes_bonus = 2 * empty_holes
+
+		return (time_remaining, time_bonus, empty_holes, holes_bonus)
+
 	# Return values for this function:
 	# -1: User closed the application window
 	#  0: The game was aborted
@@ -1634,9 +2894,7 @@ class Game:
 	#  2: User achieved a highscore
 	def play(self):
 		# Draw the loading screen
-		backdrop = load_image('backdrop.jpg', None,
-			(screen_width, screen_height))
-		screen.blit( backdrop, (0,0))
+		screen.blit( self.backdrop, (0,0))
 		pygame.display.update()
 
 		popup("Please wait...\n", (150, 50))
@@ -1647,9 +2905,24 @@ class Game:
 
 		while 1:
 			# Play a level
-			board = Board( self, board_pos)
+			try:
+				board = Board( self, board_pos)
+			except LevelError, error:
+				print "Error:", error
+				rc = self.board_dialog( "This level can't be played:\n" +
+					error.problem + "\nClick to continue.", 0)
+				if rc == -2: return -1
+				return 0
 
-			rc = board.play_level()
+			if record_replays:
+				recorder = Replay( self, board)
+				rc = board.play_level( recorder=recorder)
+				try:
+					recorder.save( replay_filename( self))
+				except (IOError, OSError), message:
+					print "Warning: Can't save replay:", message
+			else:
+				rc = board.play_level()
 
 			# Check for the user closing the window
 			if rc == -4: return -1
@@ -1697,24 +2970,8 @@ class Game:
 					self.lives = initial_lives
 			else:
 				# The board was completed
-
-				# Compute time remaining bonus
-				time_remaining = 100 * board.board_timeout / \
-					board.board_timeout_start
-				time_bonus = 5 * time_remaining
-
-				# Compute empty holes bonus
-				total_holes = 0
-				empty_holes = 0
-				for row in board.tiles:
-					for tile in row:
-						if isinstance( tile, Wheel):
-							total_holes += 4
-							for i in tile.marbles:
-								if i < 0: empty_holes += 1
-				empty_holes = (100 * empty_holes + total_holes/2) / total_holes
-				holes_bonus = 2 * empty_holes
-
+				time_remaining, time_bonus, empty_holes, holes_bonus = \
+					self.level_bonus( board)
 				self.increase_score( time_bonus + holes_bonus)
 
 				message = 'Level Complete!\n'+ \
@@ -1917,15 +3174,11 @@ class IntroScreen:
 			self.undraw_highscores()
 			return
 
-		self.screen.set_clip( self.menu_rect)
-		self.draw_background()
-		self.screen.set_clip()
+		restore_background( self.screen, self.background, self.menu_rect)
 		self.dirty_rects.append( self.menu_rect)
 
 	def undraw_highscores(self):
-		self.screen.set_clip( self.hs_rect)
-		self.draw_background()
-		self.screen.set_clip()
+		restore_background( self.screen, self.background, self.hs_rect)
 		self.dirty_rects.append( self.hs_rect)
 
 	def draw_menu(self):
@@ -1950,7 +3203,7 @@ class IntroScreen:
 			y += self.menu_font_height
 			
 		menuLevelName = IntroScreen.start_level
-		if menuLevelName > levelNumber[levelset]: menuLevelName = "Random level"
+		if menuLevelName > getLevelNumber(levelset): menuLevelName = "Random level"
 		else: menuLevelName = "Level "+`menuLevelName`
 		levelt = self.menu_font.render(menuLevelName,
 					       1, self.menu_color)
@@ -2023,7 +3276,7 @@ class IntroScreen:
 		curLevelset = levelset.replace(' ','-')
 		levelsetScores = [s for s in self.highscores.scores if s[1] == curLevelset]
 		if levelsetScores and (IntroScreen.start_level < max([s[2] for s in levelsetScores])) \
-				and IntroScreen.start_level < levelNumber[levelset]+1:
+				and IntroScreen.start_level < getLevelNumber(levelset)+1:
 				IntroScreen.start_level += 1
 
 	def dec_level(self):
@@ -2031,9 +3284,13 @@ class IntroScreen:
 			IntroScreen.start_level -= 1
 			
 	def inc_levelset(self):
-		if IntroScreen.start_levelset < len(customsSetsFiles)-1:
-			IntroScreen.start_levelset += 1
-		else: IntroScreen.start_levelset = 0
+		# Skip over any empty levelsets
+		while 1:
+			if IntroScreen.start_levelset < len(customsSetsFiles)-1:
+				IntroScreen.start_levelset += 1
+			else: IntroScreen.start_levelset = 0
+			levelsetName = customsSetsFiles[IntroScreen.start_levelset]
+			if getLevelNumber(levelsetName) > 0: break
 
 	def do(self, show_highscores=0):
 		self.scroller_pos = -self.scroller_rect[2]
@@ -2258,61 +3515,96 @@ def setup_everything():
 		pygame.mixer.pre_init(44100,-16,1,4096)
 
 	# Initialize the game module
+	start = time.time()
 	pygame.display.init()
+	log_startup( 'pygame.display.init', start)
+	start = time.time()
 	try:
 		pygame.mixer.init()
 	except:
 		print "error on pygame.mixer.init() inside setup_everything():"
 		print sys.exc_info()[0],":",sys.exc_info()[1]
 		print "...ignoring it"
+	log_startup( 'pygame.mixer.init', start)
 	pygame.font.init()
 	pygame.key.set_repeat(500, 30)
 
 	if not pygame.font: print 'Warning, fonts disabled'
 	if not pygame.mixer: print 'Warning, sound disabled'
 
+	start = time.time()
 	set_video_mode()
-	load_sounds()
+	log_startup( 'set_video_mode', start)
+	start_loading_sounds()
+	start = time.time()
 	load_fonts()
+	log_startup( 'load_fonts', start)
+	start = time.time()
 	load_images()
-	
-	# Check levelsets / populate levels number
-	emptySets=[]
-	for levelset in customsSetsFiles:
-		num = countLevels(levelset)
-		if num == 0: emptySets.append(levelset)
-		else: levelNumber[levelset] = num
-	for setToRemove in emptySets: customsSetsFiles.remove(setToRemove)
+	log_startup( 'load_images', start)
+	start = time.time()
+	save_image_atlas()
+	log_startup( 'save_image_atlas', start)
 
+	# The levelsets are counted when the menu first needs them
+	start = time.time()
 	introscreen = IntroScreen( screen, highscores)
+	log_startup( 'intro screen ready', start)
+
+# Prepare the module for running boards without a display or mixer.
+# All of the sound effects become silent placeholders.
+def setup_headless():
+	load_sounds()
+
+if __name__ == '__main__':
+	# Load the highscores file
+	highscores = HighScores( highscores_file)
 
-# Load the highscores file
-highscores = HighScores( highscores_file)
+	if frame_overlay or trace_file is not None:
+		frame_timer = FrameTimer( trace_file is not None)
 
-setup_everything()
+	setup_everything()
 
-# Main loop
-show_highscores = 0
-while 1:
-	# Display the intro screen
+	# Play back a recorded level and quit
+	if replay_file is not None:
+		replay = Replay().load( replay_file)
+		game = replay.make_game( screen, highscores)
+		try:
+			board = Board( game, board_pos, replay.seed)
+		except LevelError, message:
+			print "Error:", message
+			sys.exit(1)
+		rc = board.play_level( replay)
+		print "Replay finished at frame", board.frame, "with result", rc, \
+			"and score", game.score
+		if trace_file is not None: frame_timer.save( trace_file)
+		sys.exit(0)
+
+	# Main loop
+	show_highscores = 0
 	while 1:
-		rc = introscreen.do( show_highscores)
-		if rc == -3:
-			# Warm restart to toggle fullscreen
-			fullscreen = fullscreen ^ 1
-			setup_everything()
-		else:
-			break
+		# Display the intro screen
+		while 1:
+			rc = introscreen.do( show_highscores)
+			if rc == -3:
+				# Warm restart to toggle fullscreen
+				fullscreen = fullscreen ^ 1
+				setup_everything()
+			else:
+				break
+
+		if rc < 0: break   # Handle the QUIT message
 
-	if rc < 0: break   # Handle the QUIT message
+		# If rc is positive, it's a level.
 
-	# If rc is positive, it's a level.
+		game = Game(screen, (levelsetFolder,levelset), highscores, rc - 1,
+			game_seed)
 
-	game = Game(screen, (levelsetFolder,levelset), highscores, rc - 1)
+		show_highscores = 1
 
-	show_highscores = 1
+		rc = game.play()
+		if rc < 0: break   # Handle the QUIT message
+		if rc == 0: show_highscores = 0
 
-	rc = game.play()
-	if rc < 0: break   # Handle the QUIT message
-	if rc == 0: show_highscores = 0
+	if trace_file is not None: frame_timer.save( trace_file)
 
@@ -0,0 +1,269 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Checks whether the levels of a levelset can be completed, by searching
+# over wheel rotations and marble ejections with the headless Engine.
+#
+# The search is a beam search: every decision_interval frames each
+# surviving board tries every useful move (including doing nothing),
+# and only the beam_width most promising results are kept.  It is not
+# exhaustive, so "no solution found" does not prove a level impossible.
+
+# Import Modules
+import os, sys, time, multiprocessing
+import pathological
+from pathological import Engine, Game, LevelError, frames_per_sec, \
+	wheel_steps
+
+# Search defaults
+decision_interval = 100  # Frames between two moves
+beam_width = 6           # Boards kept after each decision
+time_limit = 600         # Seconds of search per level
+game_seed = 0            # Keeps the launch queue the same between runs
+
+# The moves worth trying on this board.  Each move is a sequence of
+# Engine events, applied one full wheel turn apart; the empty move
+# lets the board run without input.
+def moves(engine):
+	result = [()]
+	for wheel in engine.wheels:
+		if wheel.spinpos: continue
+
+		# Rotating only matters if there is a marble to move,
+		# and it is refused while a marble is entering.  A turn that
+		# leaves the holes as they were, or as a shorter turn leaves
+		# them, is not worth trying.
+		if max(wheel.marbles) >= 0 and \
+			-1 not in wheel.marbles and -2 not in wheel.marbles:
+			marbles = list(wheel.marbles)
+			tried = [marbles]
+			for turns in range(1, 4):
+				marbles = marbles[1:] + marbles[:1]
+				if marbles in tried: break
+				tried.append( marbles)
+				result.append( (('rotate', wheel.x, wheel.y),) * turns)
+
+		for i in range(4):
+			if wheel.marbles[i] < 0: continue
+			if (wheel.paths & (1 << i)) == 0: continue
+			if wheel.y == 0 and i == 0: continue
+			result.append( (('eject', wheel.x, wheel.y, i),))
+	return result
+
+# Play a move one wheel turn per event, then let the board run until
+# the given number of frames have passed.  Returns the events played,
+# as a list of (frame, event) pairs.
+def play_move(engine, move, frames):
+	history = []
+	end = engine.frame + frames
+	pending = list(move)
+	while pending and engine.frame < end and not engine.board_complete:
+		event = pending.pop(0)
+		history.append( (engine.frame + 1, event))
+		engine.step( (event,))
+		engine.advance( min( wheel_steps - 1, end - engine.frame))
+	engine.advance( end - engine.frame)
+	return history
+
+# A summary of the board used to drop duplicate boards from the beam
+def state_key(engine):
+	key = []
+	for wheel in engine.wheels:
+		key.append( (wheel.completed, wheel.spinpos, tuple(wheel.marbles)))
+	for marble in engine.marbles:
+		key.append( (marble.x, marble.y, marble.direction, marble.color))
+	if engine.trigger is not None:
+		key.append( engine.trigger.marbles and tuple(engine.trigger.marbles))
+	if engine.stoplight is not None:
+		key.append( engine.stoplight.current)
+	return tuple(key)
+
+# How promising a board looks; higher is better
+def evaluate(engine):
+	score = 0
+	for wheel in engine.wheels:
+		# A full wheel can not take any more marbles until emptied
+		full = min(wheel.marbles) >= 0
+		if full: score -= 15
+
+		# Keep the entrances from the launcher open
+		if wheel.y == 0 and (wheel.paths & 1) and wheel.marbles[0] == -3:
+			score += 5
+
+		if wheel.completed:
+			score += 1000
+			continue
+
+		# Reward holes filled with a single color
+		counts = {}
+		wild = 0
+		for c in wheel.marbles:
+			if c == 8: wild += 1
+			elif c >= 0: counts[c] = counts.get( c, 0) + 1
+		if counts: best = max(counts.values())
+		else: best = 0
+		score += 10 * (best + wild)
+
+		# A full wheel of mixed colors can only be completed once the
+		# marbles of the other colors are out of it
+		if full: score -= 15 * (sum(counts.values()) - best)
+
+	# Boards that keep taking marbles in are further from a launch timeout,
+	# and marbles left rolling around count against the live marble limit
+	score += 20 * engine.launch_timeout / engine.launch_timeout_start
+	score -= 5 * len(engine.marbles)
+	return score
+
+# Search for a winning sequence of moves on a started engine.
+# Returns (status, engine, moves, nodes) where status is 'solved',
+# 'no solution found' or 'search timed out', and moves is a list of
+# (frame, event) pairs suitable for Engine.run.
+def solve(engine, interval=decision_interval, width=beam_width,
+	limit=time_limit):
+	deadline = time.time() + limit
+	beam = [(engine, [])]
+	best = (engine, [])
+	nodes = 0
+
+	while beam:
+		candidates = []
+		seen = {}
+		for board, history in beam:
+			for move in moves(board):
+				if time.time() > deadline:
+					return ('search timed out', best[0], best[1], nodes)
+
+				child = board.clone()
+				child_history = history + play_move( child, move, interval)
+				nodes += 1
+
+				if child.board_complete > 0:
+					return ('solved', child, child_history, nodes)
+				if child.board_complete < 0: continue
+
+				key = state_key( child)
+				if key in seen: continue
+				seen[key] = 1
+				candidates.append(
+					(evaluate( child), len(child_history),
+					child, child_history))
+
+		# Prefer the best boards, and the fewest moves among equals
+		candidates.sort( lambda a, b: cmp(b[0], a[0]) or cmp(a[1], b[1]))
+		beam = [(c[2], c[3]) for c in candidates[:width]]
+		if beam: best = beam[0]
+
+	return ('no solution found', best[0], best[1], nodes)
+
+# Check a single level; run in the worker processes
+def check_level(args):
+	circuit, level, seed, interval, width, limit = args
+
+	start = time.time()
+	game = Game( None, circuit, None, level, seed)
+	try:
+		engine = Engine( game)
+	except LevelError, error:
+		name = pathological.load_levelset( os.path.join( *circuit)).levels[
+			level][0][0] or "Unnamed"
+		return (level, name, 'invalid level: ' + error.problem, 0, 0, [], 0,
+			time.time() - start)
+	engine.start()
+	board_time = engine.board_timeout_start / frames_per_sec
+
+	status, engine, history, nodes = solve( engine, interval, width, limit)
+	return (level, engine.name, status, engine.frame, board_time,
+		history, nodes, time.time() - start)
+
+def format_result(result):
+	level, name, status, frames, board_time, history, nodes, elapsed = result
+	line = "%3d  %-28s %s" % (level + 1, name[:28], status)
+	if status == 'solved':
+		line += " after %.1fs of %ds, %d moves" % \
+			(float(frames) / frames_per_sec, board_time, len(history))
+	line += " (%d boards searched in %.1fs)\n" % (nodes, elapsed)
+	if status == 'solved':
+		for frame, event in history:
+			line += "       %6d %s\n" % (frame, ' '.join(map(str, event)))
+	return line
+
+def init_worker():
+	pathological.setup_headless()
+
+def usage():
+	print "Usage: "+sys.argv[0]+ \
+		" [-j jobs] [-i interval] [-w width] [-t seconds] [-s seed]" + \
+		" [-o report]" + \
+		" levelset-file [level ...]\n"
+	sys.exit(1)
+
+if __name__ == '__main__':
+	jobs = multiprocessing.cpu_count()
+	interval = decision_interval
+	width = beam_width
+	limit = time_limit
+	seed = game_seed
+	report = None
+	levelset_file = None
+	levels = []
+
+	args = sys.argv[1:]
+	try:
+		while args:
+			arg = args.pop(0)
+			if arg == '-j': jobs = int(args.pop(0))
+			elif arg == '-i': interval = int(args.pop(0))
+			elif arg == '-w': width = int(args.pop(0))
+			elif arg == '-t': limit = int(args.pop(0))
+			elif arg == '-s': seed = int(args.pop(0))
+			elif arg == '-o': report = args.pop(0)
+			elif arg[0] == '-': usage()
+			elif levelset_file is None: levelset_file = arg
+			else: levels.append( int(arg) - 1)
+	except (IndexError, ValueError):
+		usage()
+	if levelset_file is None: usage()
+
+	circuit = os.path.split( levelset_file)
+	numlevels = len(pathological.load_levelset( levelset_file).levels)
+	if not levels: levels = range( numlevels)
+
+	tasks = [(circuit, level, seed, interval, width, limit)
+		for level in levels]
+
+	init_worker()
+	if jobs > 1:
+		pool = multiprocessing.Pool( jobs, init_worker)
+		results = pool.imap( check_level, tasks)
+	else:
+		results = map( check_level, tasks)
+
+	if report is None: f = sys.stdout
+	else: f = open( report, "w")
+	f.write( "Levelset: " + levelset_file + "\n")
+	solved = 0
+	for result in results:
+		if result[2] == 'solved': solved += 1
+		f.write( format_result( result))
+		f.flush()
+	f.write( `solved` + " of " + `len(tasks)` + " levels solved\n")
+	if report is not None: f.close()
@@ -0,0 +1,135 @@
+# The backup store of the Custom levelset
+
+import os, sys, shutil, tempfile, unittest
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import backups
+from backups import BackupStore
+
+day = 24 * 3600
+start = 1700000000
+
+# The text of the i-th version of a levelset: each one changes a line
+# and the length of the one before
+def version_text(i):
+	lines = ["|   | %d |   |\n" % j for j in range( 40)]
+	lines[i % 40] = "| %d |   |   |\n" % i
+	return ''.join(lines[:25 + i % 15])
+
+class Crash(Exception):
+	pass
+
+class BackupStoreTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.store_dir = os.path.join( self.dir, 'backups')
+		self.texts = {}
+
+	def tearDown(self):
+		backups.write_file = self.write_file
+		shutil.rmtree( self.dir)
+
+	write_file = staticmethod( backups.write_file)
+
+	def add(self, store, i):
+		text = version_text( i)
+		self.texts[backups.md5.new( text).hexdigest()] = text
+		return store.add( text, start + i * day / 3)
+
+	def assertIntact(self, directory):
+		store = BackupStore( directory)
+		versions = store.versions()
+		self.failUnless( versions)
+		target = os.path.join( self.dir, 'Custom')
+		for when, key in versions:
+			self.assertEqual( store.read( key), self.texts[key])
+		for when, key in versions:
+			# Restoring backs up the current set, so each one works on
+			# a copy of the store as it is
+			copy = os.path.join( self.dir, 'restore')
+			shutil.copytree( directory, copy)
+			BackupStore( copy).restore( key, target)
+			self.assertEqual( open( target).read(), self.texts[key])
+			shutil.rmtree( copy)
+
+	def test_unchanged_not_stored(self):
+		store = BackupStore( self.store_dir)
+		self.failUnless( self.add( store, 0))
+		self.assertEqual( self.add( store, 0), None)
+		self.assertEqual( len(store.versions()), 1)
+
+	def test_retention(self):
+		store = BackupStore( self.store_dir)
+		for i in range( 60): self.add( store, i)
+		versions = store.versions()
+		self.assertEqual( versions, store.retain( versions))
+		self.failUnless( len(versions) < 25)
+		self.assertEqual( versions[-backups.keep_last:],
+			[(start + i * day / 3, backups.md5.new( version_text( i)).hexdigest())
+				for i in range( 60 - backups.keep_last, 60)])
+		objects = [name for name in os.listdir( self.store_dir)
+			if name != 'index']
+		self.assertEqual( len(objects), len(versions))
+		self.assertIntact( self.store_dir)
+
+	def test_crash_in_repack(self):
+		store = BackupStore( self.store_dir)
+		for i in range( 30): self.add( store, i)
+		before = store.versions()
+
+		# Crash at every write of the next backup in turn
+		crashes = 0
+		while 1:
+			directory = os.path.join( self.dir, `crashes`)
+			shutil.copytree( self.store_dir, directory)
+			calls = [0]
+			def write_file(filename, data):
+				calls[0] += 1
+				if calls[0] > crashes:
+					# Half written, and never renamed
+					f = open( filename + '.' + `os.getpid()` + '~', 'wb')
+					f.write( data[:len(data) / 2])
+					f.close()
+					raise Crash
+				self.write_file( filename, data)
+			backups.write_file = write_file
+			try:
+				self.add( BackupStore( directory), 30)
+			except Crash:
+				backups.write_file = self.write_file
+				self.assertEqual( BackupStore( directory).versions(), before)
+				self.assertIntact( directory)
+				crashes += 1
+				continue
+			backups.write_file = self.write_file
+			break
+		self.failUnless( crashes > 2)
+
+		# The next backup after a crash cleans up what it left
+		directory = os.path.join( self.dir, `crashes - 1`)
+		store = BackupStore( directory)
+		self.add( store, 31)
+		self.assertEqual( len(os.listdir( directory)),
+			len(store.versions()) + 1)
+		self.assertIntact( directory)
+
+	def test_import_old(self):
+		os.makedirs( self.store_dir)
+		for k, i in enumerate( (0, 1, 1, 2)):
+			name = time_name( start + k * day) + backups.old_backup_suffix
+			f = open( os.path.join( self.store_dir, name), 'w')
+			f.write( version_text( i))
+			f.close()
+			self.texts[backups.md5.new( version_text( i)).hexdigest()] = \
+				version_text( i)
+		store = BackupStore( self.store_dir)
+		self.assertEqual( store.import_old(), 4)
+		self.assertEqual( len(store.versions()), 3)
+		self.assertIntact( self.store_dir)
+
+def time_name(when):
+	return backups.time.strftime( backups.old_backup_format,
+		backups.time.localtime( when))
+
+if __name__ == '__main__':
+	unittest.main()
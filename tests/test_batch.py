@@ -0,0 +1,67 @@
+# Stepping boards together with the BatchEngine
+
+import os, sys, shutil, tempfile, unittest
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy')
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import pathological, batch
+from pathological import Game, Engine
+
+pathological.setup_headless()
+
+# The launcher feeds a wheel through an unpaired teleporter
+unpaired = "name=Unpaired\n" + \
+	"|=5a|   |   |   |   |   |   |   |\n" + \
+	"|O5 |   |   |   |   |   |   |   |\n" + \
+	"|   |   |   |   |   |   |   |   |\n" * 4
+
+class BatchEngineTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cache_dir = pathological.cache_dir
+		pathological.cache_dir = tempfile.mkdtemp()
+		f = open( os.path.join( self.dir, 'Test'), 'w')
+		f.write( unpaired)
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree( pathological.cache_dir)
+		pathological.cache_dir = self.cache_dir
+		shutil.rmtree( self.dir)
+
+	def engines(self, count):
+		engines = []
+		for seed in range( count):
+			engine = Engine( Game( None, (self.dir, 'Test'), None), seed=seed)
+			engine.start()
+			engines.append( engine)
+		return engines
+
+	def state(self, engine):
+		return (engine.frame, engine.board_complete,
+			[tuple(wheel.marbles) for wheel in engine.wheels],
+			[(m.x, m.y, m.direction, m.color) for m in engine.marbles])
+
+	def test_kind_tables(self):
+		kinds = max( pathological.tile_kinds.values()) + 1
+		self.assertEqual( len(batch.is_simple), kinds)
+		self.assertEqual( len(batch.is_center), kinds)
+
+	def test_unpaired_teleporter(self):
+		engines = self.engines( 3)
+		expected = []
+		for engine in self.engines( 3):
+			engine.advance( 1500)
+			expected.append( self.state( engine))
+
+		boards = batch.BatchEngine( engines)
+		boards.advance( 1500)
+		boards.sync()
+		self.assertEqual( [self.state( engine) for engine in engines],
+			expected)
+
+		# A marble went through the teleporter into the wheel
+		self.failUnless( max( engines[0].wheels[0].marbles) >= 0)
+
+if __name__ == '__main__':
+	unittest.main()
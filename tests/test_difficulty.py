@@ -0,0 +1,72 @@
+# The difficulty estimator on boards it could fail on
+
+import os, sys, shutil, tempfile, unittest
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy')
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import pathological, difficulty
+from pathological import Game, Engine
+
+pathological.setup_headless()
+
+# A level of plain tracks, with no wheels to complete
+no_wheels = "name=No wheels\n" + ("|" + " 5 |" * pathological.horiz_tiles +
+	"\n") * pathological.vert_tiles
+
+class NoWheelsTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cache_dir = pathological.cache_dir
+		pathological.cache_dir = tempfile.mkdtemp()
+		f = open( os.path.join( self.dir, 'Test'), 'w')
+		f.write( no_wheels)
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree( pathological.cache_dir)
+		pathological.cache_dir = self.cache_dir
+		shutil.rmtree( self.dir)
+
+	def test_level_bonus(self):
+		game = Game( None, (self.dir, 'Test'), None)
+		engine = Engine( game)
+		engine.start()
+		engine.step()
+		self.assertEqual( engine.board_complete, 1)
+		self.assertEqual( game.level_bonus( engine), (100, 500, 0, 0))
+
+	def test_play(self):
+		rc, frames, score = difficulty.play( (self.dir, 'Test'), 0, 0,
+			'random', difficulty.decision_interval)
+		self.assertEqual( rc, 1)
+		self.assertEqual( score, 500)
+
+	def test_invalid_level(self):
+		# The second level has a switch without a second direction
+		f = open( os.path.join( self.dir, 'Test'), 'a')
+		f.write( no_wheels.replace( '| 5 |', '|>5x|', 1))
+		f.close()
+		filename = os.path.join( self.dir, 'Test')
+		args = (0, 2, 'random', difficulty.decision_interval)
+		self.assertEqual( difficulty.play_chunk( (filename, 0) + args)[2:],
+			([(1, 1, 500)] * 2, None))
+		filename, level, results, problem = \
+			difficulty.play_chunk( (filename, 1) + args)
+		self.assertEqual( results, [])
+		self.assertEqual( problem,
+			"a switch needs a direction (^, >, v or <), not 'x'")
+
+class RateErrorTest(unittest.TestCase):
+	def test_rate_error(self):
+		won, lost = (1, 0, 0), (-1, 0, 0)
+		self.assertEqual( difficulty.rate_error( []), 1.0)
+
+		# Rates near 0 or 1 are known after few plays, ones in between
+		# need many more
+		self.failUnless( difficulty.rate_error( [won] * 50) < 0.05)
+		self.failUnless( difficulty.rate_error( [lost] * 50) < 0.05)
+		self.failUnless( difficulty.rate_error( [won, lost] * 50) > 0.05)
+		self.failUnless( difficulty.rate_error( [won, lost] * 200) < 0.05)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,123 @@
+# Loading levels with mistakes in them
+
+import os, sys, shutil, tempfile, unittest, StringIO
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy')
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import pathological
+from pathological import Game, Engine, LevelError
+
+pathological.setup_headless()
+
+# A level with a wheel fed from the launcher; changes maps (row, column)
+# to the three characters of a tile
+def level_text(changes={}):
+	rows = []
+	for j in range( pathological.vert_tiles):
+		row = '|'
+		for i in range( pathological.horiz_tiles):
+			if (j, i) in changes: tile = changes[(j, i)]
+			elif (j, i) == (0, 0): tile = 'O5 '
+			elif i == 0: tile = ' 5 '
+			else: tile = '   '
+			row += tile + '|'
+		rows.append( row + '\n')
+	return "name=Test\n" + ''.join(rows)
+
+class LoadLevelTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cache_dir = pathological.cache_dir
+		pathological.cache_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree( pathological.cache_dir)
+		pathological.cache_dir = self.cache_dir
+		shutil.rmtree( self.dir)
+
+	def load(self, *levels):
+		f = open( os.path.join( self.dir, 'Test'), 'w')
+		f.write( '\n'.join(levels))
+		f.close()
+		game = Game( None, (self.dir, 'Test'), None, len(levels) - 1)
+		return Engine( game)
+
+	# Load the levels, and return what was printed while loading
+	def output(self, *levels):
+		stdout = sys.stdout
+		sys.stdout = StringIO.StringIO()
+		try:
+			self.engine = self.load( *levels)
+			return sys.stdout.getvalue()
+		finally:
+			sys.stdout = stdout
+
+	def assertLevelError(self, line, column, *levels):
+		try:
+			self.load( *levels)
+		except LevelError, error:
+			where = "%s:%d:%d: level %d" % (os.path.join( self.dir, 'Test'),
+				line, column, len(levels))
+			self.assertEqual( str(error), where + ": " + error.problem)
+			return
+		self.fail( "no LevelError")
+
+	def test_good_level(self):
+		engine = self.load( level_text())
+		self.assertEqual( len(engine.wheels), 1)
+
+	def test_unknown_type_is_plain_tile(self):
+		engine = self.load( level_text( {(2, 3): 'Q5 '}))
+		tile = engine.tiles[2][3]
+		self.assertEqual( tile.kind, pathological.kind_tile)
+		self.assertEqual( tile.paths, 5)
+
+	def test_marble_without_direction(self):
+		# It rolls left, with a warning
+		output = self.output( level_text( {(2, 3): '35x'}))
+		self.assertEqual( self.engine.marbles[0].direction, 3)
+		self.assertEqual( output, "Warning: %s:4:16: level 1: a marble needs"
+			" a direction (^, >, v or <), not 'x'; it rolls left\n" %
+			os.path.join( self.dir, 'Test'))
+
+	def test_switch_with_bad_direction(self):
+		self.assertLevelError( 3, 8, level_text( {(1, 1): '>5x'}))
+
+	def test_switch_with_same_directions(self):
+		# In the second level, so that the line counts the first level
+		output = self.output( level_text(), level_text( {(3, 4): 'v5v'}))
+		self.assertEqual( output, "Warning: %s:13:20: level 2: a switch needs"
+			" two different directions, not 'vv'\n" %
+			os.path.join( self.dir, 'Test'))
+
+	def test_director_and_switch(self):
+		engine = self.load( level_text( {(1, 1): '>5 ', (1, 2): '>5^'}))
+		self.assertEqual( engine.tiles[1][1].kind, pathological.kind_director)
+		self.assertEqual( engine.tiles[1][2].kind, pathological.kind_switch)
+
+	def test_path_graph_made_when_needed(self):
+		engine = self.load( level_text())
+		self.assertEqual( engine.graph, None)
+		graph = engine.path_graph()
+		self.assertEqual( graph.unreachable_wheels, [])
+		self.failUnless( engine.clone().path_graph() is graph)
+
+	def test_compiled_levels_replaced(self):
+		filename = os.path.join( self.dir, 'Test')
+		self.load( level_text())
+		self.assertEqual( len(os.listdir( pathological.cache_dir)), 1)
+		self.load( level_text( {(1, 1): '>5 '}))
+		self.assertEqual( len(os.listdir( pathological.cache_dir)), 1)
+
+		# Read back from the cache, and rebuilt when the text changes
+		levels = pathological.Levelset( filename).levels
+		self.assertEqual( levels[0][1][(8 + 1) * 3], '>')
+		f = open( filename, 'w')
+		f.write( level_text())
+		f.close()
+		levels = pathological.Levelset( filename).levels
+		self.assertEqual( levels[0][1][(8 + 1) * 3], ' ')
+		self.assertEqual( len(os.listdir( pathological.cache_dir)), 1)
+
+if __name__ == '__main__':
+	unittest.main()
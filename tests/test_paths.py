@@ -0,0 +1,47 @@
+# The path graph of a level
+
+import os, sys, unittest
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy')
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import pathological
+from pathological import PathGraph, compile_levels
+
+# A level from rows of tiles; missing rows are empty
+def level_tiles(*rows):
+	rows = list(rows) + ["|   |   |   |   |   |   |   |   |"] * \
+		(pathological.vert_tiles - len(rows))
+	return compile_levels( '\n'.join(rows) + '\n')[0][1]
+
+class PathGraphTest(unittest.TestCase):
+	def test_wheel_fed_from_launcher(self):
+		graph = PathGraph( level_tiles(
+			"|O5 |   |   |   |   |   |   |   |"))
+		self.assertEqual( graph.unreachable_wheels, [])
+		self.failUnless( graph.can_reach( 0, 0))
+		self.failIf( graph.can_reach( 1, 0))
+
+	def test_wheel_cut_off_further_along(self):
+		# The wheel at (3,1) has tracks into it, but they lead nowhere
+		graph = PathGraph( level_tiles(
+			"|O5 |   |   |   |   |   |   |   |",
+			"| 5 |   | a |Oa | a |   |   |   |"))
+		self.assertEqual( graph.unreachable_wheels, [(3, 1)])
+
+	def test_marble_and_teleporter(self):
+		# A marble on the board goes through a teleporter to the wheel
+		graph = PathGraph( level_tiles(
+			"|O5 |   |   |   |   |   |   |   |",
+			"| 5 |2a>|=an|   |   |   |   |   |",
+			"|   |   |   |=an| a |Oa |   |   |"))
+		self.assertEqual( graph.unreachable_wheels, [])
+		self.failUnless( graph.can_reach( 5, 2))
+
+	def test_shredder_is_dead_end(self):
+		graph = PathGraph( level_tiles(
+			"|O5 |   |   |   |X5 |   |   |   |"))
+		self.failUnless( (4, 0, 2) in graph.dead_ends)
+		self.failIf( (0, 0, 2) in graph.dead_ends)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,51 @@
+# The solver on small levels
+
+import os, sys, shutil, tempfile, unittest
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy')
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import pathological, solver
+
+pathological.setup_headless()
+
+# A wheel under the launcher, with a shredder below to throw the marbles
+# of the wrong color into
+simple = "name=Simple\ncolors=12\nboardtimer=120\n" + \
+	"|O5 |   |   |   |   |   |   |   |\n" + \
+	"| 5 |   |   |   |   |   |   |   |\n" + \
+	"|X5 |   |   |   |   |   |   |   |\n" + \
+	"|   |   |   |   |   |   |   |   |\n" * 3
+
+class SolverTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cache_dir = pathological.cache_dir
+		pathological.cache_dir = tempfile.mkdtemp()
+		f = open( os.path.join( self.dir, 'Test'), 'w')
+		f.write( simple + simple.replace( 'X5 ', '>5x'))
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree( pathological.cache_dir)
+		pathological.cache_dir = self.cache_dir
+		shutil.rmtree( self.dir)
+
+	def check(self, level, limit):
+		return solver.check_level( ((self.dir, 'Test'), level, 0,
+			solver.decision_interval, solver.beam_width, limit))
+
+	def test_simple_level(self):
+		result = self.check( 0, 20)
+		self.assertEqual( result[:3], (0, 'Simple', 'solved'))
+
+		# The moves found complete the level when played again
+		engine = pathological.Engine( pathological.Game( None,
+			(self.dir, 'Test'), None, 0, 0))
+		self.assertEqual( engine.run( result[5]), 1)
+
+	def test_invalid_level(self):
+		result = self.check( 1, 20)
+		problem = "a switch needs a direction (^, >, v or <), not 'x'"
+		self.assertEqual( result[:3], (1, 'Simple', 'invalid level: ' + problem))
+		self.failUnless( solver.format_result( result).startswith(
+			"  2  Simple                       invalid level: " + problem))
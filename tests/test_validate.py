@@ -0,0 +1,52 @@
+# The levelset validator
+
+import os, sys, shutil, tempfile, unittest
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy')
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+
+import validate
+
+class ValidateTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree( self.dir)
+
+	def validate(self, *rows):
+		rows = list(rows) + \
+			["|   |   |   |   |   |   |   |   |"] * (6 - len(rows))
+		filename = os.path.join( self.dir, 'Test')
+		f = open( filename, 'w')
+		f.write( "name=Test\n" + '\n'.join(rows) + '\n')
+		f.close()
+		return validate.validate( filename)
+
+	def test_good_level(self):
+		self.assertEqual( self.validate(
+			"|O5 |   |   |   |   |   |   |   |"), (1, []))
+
+	def test_wheel_cut_off_in_second_level(self):
+		# The tracks next to the wheel lead nowhere; the problem is
+		# reported at its line in the second level
+		good = "|O5 |   |   |   |   |   |   |   |\n" + \
+			"|   |   |   |   |   |   |   |   |\n" * 5
+		bad = "|O5 |   |   |   |   |   |   |   |\n" + \
+			"| 5 |   | a |Oa | a |   |   |   |\n" + \
+			"|   |   |   |   |   |   |   |   |\n" * 4
+		filename = os.path.join( self.dir, 'Test')
+		f = open( filename, 'w')
+		f.write( "name=Good\n" + good + "name=Bad\n" + bad)
+		f.close()
+		self.assertEqual( validate.validate( filename),
+			(2, [(10, 14, "no marble can get into this wheel")]))
+
+	def test_levelset_files(self):
+		for name in ('b', 'a', '.hidden'):
+			open( os.path.join( self.dir, name), 'w').close()
+		os.mkdir( os.path.join( self.dir, 'sub'))
+		self.assertEqual( validate.levelset_files( [self.dir, 'x']),
+			[os.path.join( self.dir, 'a'), os.path.join( self.dir, 'b'), 'x'])
+
+if __name__ == '__main__':
+	unittest.main()
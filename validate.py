@@ -0,0 +1,249 @@
+#! /usr/bin/python
+# -*- coding: iso-8859-1 -*-
+"""
+Copyright (C) 2003  John-Paul Gignac
+          (C) 2004  Joe Wreschnig
+          (C) 2016 Nina Ripoll (Editor/Levelsets)
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Checks levelset files for the mistakes that make the game crash or
+# misbehave, and reports each one with its line and column.
+#
+# A file is read line by line, in a single pass; each level is checked
+# as soon as its last row has been read.  The checks follow the way
+# compile_levels and Engine._load read a level.
+
+# Import Modules
+import sys, multiprocessing
+from pathological import horiz_tiles, vert_tiles, tile_kinds, \
+	direction_chars, level_settings, default_colors, default_stoplight, \
+	PathGraph, levelset_files
+
+path_chars = ' 0123456789abcdef'
+color_chars = '012345678'
+row_length = horiz_tiles * 4 + 1
+
+# The control characters each tile type accepts, if it is checked
+controls = {
+	'&': (color_chars, "a painter needs a color"),
+	'#': (color_chars, "a filter needs a color"),
+	'@': (' ' + color_chars, "a buffer needs a color or a blank"),
+	'*': (' 0123456789', "a replicator needs a number of copies"),
+	}
+for c in direction_chars:
+	controls[c] = (' ' + direction_chars,
+		"a switch needs a direction (^, >, v or <) or a blank")
+for c in color_chars:
+	controls[c] = (direction_chars,
+		"a marble needs a direction (^, >, v or <)")
+
+# Check one level, once all of its rows have been read.
+# settings maps each setting to (value, line, column) and tiles holds
+# (type, paths, control, line, column) in row order.
+def check_level(settings, tiles, problems):
+	def report(line, column, message):
+		problems.append( (line, column, message))
+
+	# The numbers must read as numbers
+	for key in ('maxmarbles', 'launchtimer', 'boardtimer'):
+		if key not in settings: continue
+		value, line, column = settings[key]
+		try:
+			int(value)
+		except ValueError:
+			report( line, column, key + " is not a number: " + `value`)
+
+	colors = default_colors
+	if 'colors' in settings:
+		value, line, column = settings['colors']
+		colors = []
+		for i in range(len(value)):
+			if value[i] in color_chars: colors.append( int(value[i]))
+			elif value[i] not in ', ':
+				report( line, column + i, "unknown color " + `value[i]`)
+		if not colors: report( line, column, "no marble colors")
+
+	# The colors a marble can have on this board
+	available = set(colors)
+	teleporters = {}
+	wheels = 0
+	stoplights = []
+	for i in range(len(tiles)):
+		type, paths, control, line, column = tiles[i]
+		if type not in tile_kinds:
+			report( line, column, "unknown tile type " + `type`)
+			continue
+		if paths not in path_chars:
+			report( line, column + 1, "bad paths " + `paths`)
+		if type in controls and control not in controls[type][0]:
+			report( line, column + 2, controls[type][1])
+
+		if type == '=':
+			teleporters.setdefault( control, []).append( (line, column))
+		elif type == 'O': wheels += 1
+		elif type == '!': stoplights.append( (line, column))
+		elif type in '&@' + color_chars and control in color_chars:
+			available.add( int(control))
+		if type in color_chars: available.add( int(type))
+
+	# Engine._load pairs each teleporter with the first one of its label
+	for label, places in teleporters.items():
+		if len(places) == 2: continue
+		for line, column in places:
+			if len(places) == 1:
+				report( line, column + 2,
+					"teleporter " + `label` + " has no partner")
+			else:
+				report( line, column + 2, "teleporter " + `label` +
+					" is used " + `len(places)` + " times, not twice")
+
+	# Every wheel needs a way in, from the launcher or a marble on the
+	# board, however far along the tracks
+	compiled = []
+	for type, paths, control, line, column in tiles:
+		compiled.append( type + chr(max( path_chars.find( paths) - 1, 0)) +
+			control)
+	for x, y in PathGraph( ''.join(compiled)).unreachable_wheels:
+		type, paths, control, line, column = tiles[y * horiz_tiles + x]
+		report( line, column, "no marble can get into this wheel")
+	if not wheels and tiles:
+		type, paths, control, line, column = tiles[0]
+		report( line, column, "level has no wheels")
+
+	# The stoplight colors must be ones the marbles can have
+	if len(stoplights) > 1:
+		for line, column in stoplights[1:]:
+			report( line, column, "only one stoplight is used")
+	if stoplights:
+		if 'stoplight' in settings:
+			value, line, column = settings['stoplight']
+			stoplight = []
+			for i in range(len(value)):
+				if value[i] in color_chars[:-1]:
+					stoplight.append( (int(value[i]), column + i))
+			if len(stoplight) != 3:
+				report( line, column, "a stoplight needs 3 colors, not " +
+					`len(stoplight)`)
+		else:
+			line, column = stoplights[0]
+			stoplight = [(c, column) for c in default_stoplight]
+		if 8 not in available:
+			for c, column in stoplight:
+				if c not in available:
+					report( line, column, "stoplight color " + `c` +
+						" is not in colors and no tile makes it")
+
+def read_setting(text, line, settings):
+	for key in level_settings:
+		if text.startswith( key + '='):
+			settings[key] = (text[len(key)+1:], line, len(key) + 2)
+
+# Check a levelset file.  Returns the number of levels and the list of
+# problems, as (line, column, message), with lines and columns from 1.
+def validate(filename):
+	problems = []
+	settings = {}
+	tiles = []
+	rows = 0
+	first_row = 0
+	levels = 0
+
+	f = open( filename)
+	line = 0
+	for text in f:
+		line += 1
+		text = text.rstrip( '\r\n')
+		if text[:1] == '|':
+			if rows == 0: first_row = line
+			rows += 1
+			if len(text) != row_length:
+				problems.append( (line, min( len(text), row_length) + 1,
+					"row is " + `len(text)` + " characters long, not " +
+					`row_length`))
+			text = text.ljust( row_length)
+			for i in range(horiz_tiles):
+				if text[i*4] != '|':
+					problems.append( (line, i*4 + 1, "missing '|'"))
+				tiles.append( (text[i*4+1], text[i*4+2], text[i*4+3],
+					line, i*4 + 2))
+			if rows < vert_tiles: continue
+
+		elif rows == 0:
+			read_setting( text, line, settings)
+			continue
+
+		if rows != vert_tiles:
+			problems.append( (first_row, 1, "level has " + `rows` +
+				" rows, not " + `vert_tiles`))
+		else:
+			check_level( settings, tiles, problems)
+			levels += 1
+		settings = {}
+		tiles = []
+		rows = 0
+		if text[:1] != '|': read_setting( text, line, settings)
+	f.close()
+
+	if rows:
+		problems.append( (first_row, 1, "level has " + `rows` +
+			" rows, not " + `vert_tiles`))
+	if not levels: problems.append( (1, 1, "no levels"))
+	problems.sort()
+	return (levels, problems)
+
+# Check a file; run in the worker processes
+def validate_file(filename):
+	try:
+		levels, problems = validate( filename)
+	except (IOError, OSError), message:
+		return (filename, 0, [(0, 0, str(message))])
+	return (filename, levels, problems)
+
+def usage():
+	print "Usage: "+sys.argv[0]+" [-j jobs] [levelset-file|levelset-dir ...]"
+	print "Checks the levelsets in user_circuits if none are given.\n"
+	sys.exit(1)
+
+if __name__ == '__main__':
+	jobs = multiprocessing.cpu_count()
+	names = []
+
+	args = sys.argv[1:]
+	try:
+		while args:
+			arg = args.pop(0)
+			if arg == '-j': jobs = int(args.pop(0))
+			elif arg[0] == '-': usage()
+			else: names.append( arg)
+	except (IndexError, ValueError):
+		usage()
+	if not names: names = ['user_circuits']
+
+	files = levelset_files( names)
+	if jobs > 1 and len(files) > 1:
+		pool = multiprocessing.Pool( min( jobs, len(files)))
+		results = pool.imap( validate_file, files)
+	else:
+		results = map( validate_file, files)
+
+	count = 0
+	for filename, levels, problems in results:
+		for line, column, message in problems:
+			print "%s:%d:%d: %s" % (filename, line, column, message)
+		count += len(problems)
+	print `count`, "problems found in", `len(files)`, "levelsets"
+	if count: sys.exit(1)